@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        bench_import.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: Startup time of `import pyncare` in fresh interpreters, and
+             a guard that the numerical core does not load the plotting
+             stack (matplotlib) nor optional packages (sympy).
+
+                 python benchmarks/bench_import.py [--repeat 5] [--max-seconds 2.0]
+
+             Exits with status 1 when a forbidden module is imported or the
+             best time is above --max-seconds.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FORBIDDEN = ('matplotlib', 'mpl_toolkits', 'sympy')
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import pyncare
+seconds = time.perf_counter() - t0
+loaded = sorted(set(m.split('.')[0] for m in sys.modules) & set({forbidden!r}))
+print(json.dumps({{'seconds': seconds, 'forbidden': loaded}}))
+"""
+
+
+def environment():
+    """Environment of the subprocesses, with the implicit imports of pyncare."""
+    env = dict(os.environ)
+    path = [ROOT, os.path.join(ROOT, 'pyncare')]
+    if env.get('PYTHONPATH'):
+        path.append(env['PYTHONPATH'])
+    env['PYTHONPATH'] = os.pathsep.join(path)
+    return env
+
+
+def run(repeat=5):
+    """Time `import pyncare` repeat times, each in a new interpreter."""
+    code = _PROBE.format(forbidden=FORBIDDEN)
+    samples, forbidden = [], set()
+    for i in range(repeat):
+        out = subprocess.check_output([sys.executable, '-W', 'ignore', '-c', code],
+                                      env=environment())
+        result = json.loads(out.decode().strip().splitlines()[-1])
+        samples.append(result['seconds'])
+        forbidden.update(result['forbidden'])
+    samples.sort()
+    return {'name': 'import_pyncare',
+            'best': samples[0],
+            'median': samples[len(samples) // 2],
+            'samples': samples,
+            'forbidden': sorted(forbidden)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=None)
+    args = parser.parse_args()
+    result = run(args.repeat)
+    print(json.dumps(result, indent=2))
+    if result['forbidden']:
+        sys.exit("import pyncare loaded {}".format(', '.join(result['forbidden'])))
+    if args.max_seconds is not None and result['best'] > args.max_seconds:
+        sys.exit("import pyncare took {:.3f} s > {} s".format(result['best'], args.max_seconds))
+
+
+if __name__ == "__main__":
+    main()
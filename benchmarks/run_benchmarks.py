@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        run_benchmarks.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: Benchmarks of the hot paths of pyncare, with the bundled
+             models compact_dyn_sys_phi2 and dyn_sys_exp_yukawa_bounded as
+             fixtures:
+
+                 orbit_evolve     one orbit, per integrator
+                 ensemble         10 ... 10**5 orbits integrated as a batch
+                 vector_field     model over 2D grids
+                 flow             flow arrows along solved orbits
+                 triangle         triangle plots for Ndim 3 ... 6
+                 import           import pyncare in a fresh interpreter
+
+             Results are written as JSON (one file per run, named after
+             the git commit by default) and two runs can be compared:
+
+                 python benchmarks/run_benchmarks.py [--quick] [-k ensemble]
+                 python benchmarks/run_benchmarks.py --compare old.json new.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import warnings
+from collections import OrderedDict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'pyncare')]
+
+import numpy as np                                   # noqa: E402
+import bench_import                                  # noqa: E402
+import ensemble                                      # noqa: E402
+from constraints import Ball                         # noqa: E402
+from dynsysbase import BaseDynSys                    # noqa: E402
+from models import compact_dyn_sys_phi2, dyn_sys_exp_yukawa_bounded  # noqa: E402
+from orbit import Orbit                              # noqa: E402
+from protocol import vectorized                      # noqa: E402
+
+YUKAWA_PARS = [1.0, 0.1]
+
+
+def yukawa_inits(n, seed=0):
+    """Initial conditions inside the physical region x**2 + y**2 < 1, y > 0,
+
+    with u away from the pole of the coupling at u = 1/2.
+    """
+    rng = np.random.RandomState(seed)
+    r = 0.9 * np.sqrt(rng.random_sample(n))
+    phi = np.pi * rng.random_sample(n)
+    u = rng.uniform(-0.4, 0.4, n)
+    return np.column_stack([r * np.cos(phi), r * np.sin(phi), u])
+
+
+def phi2_inits(n, seed=0):
+    rng = np.random.RandomState(seed)
+    r = 0.9 * np.sqrt(rng.random_sample(n))
+    phi = 2.0 * np.pi * rng.random_sample(n)
+    return np.column_stack([r * np.cos(phi), r * np.sin(phi)])
+
+
+def product_model(Ndim):
+    """Uncoupled copies of the bundled models with Ndim variables in total.
+
+    3 is yukawa, 4 phi2 x phi2, 5 yukawa x phi2 and 6 yukawa x yukawa.
+    """
+    blocks = {3: [3], 4: [2, 2], 5: [3, 2], 6: [3, 3]}[Ndim]
+    fixtures = {2: (compact_dyn_sys_phi2, []), 3: (dyn_sys_exp_yukawa_bounded, YUKAWA_PARS)}
+
+    @vectorized
+    def model(init, t=None, model_pars=[]):
+        out, i = [], 0
+        for n in blocks:
+            f, pars = fixtures[n]
+            out += list(f([init[i + k] for k in range(n)], t, pars))
+            i += n
+        return out
+
+    def inits(n_orbits):
+        cols = [yukawa_inits(n_orbits, k) if n == 3 else phi2_inits(n_orbits, k)
+                for k, n in enumerate(blocks)]
+        return np.hstack(cols)
+    return model, inits
+
+
+def timeit(func, setup=None, repeat=3):
+    """Best and median wall time of func() over repeat runs."""
+    samples = []
+    for i in range(repeat):
+        state = setup() if setup is not None else None
+        t0 = time.perf_counter()
+        func(state)
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return {'best': samples[0], 'median': samples[len(samples) // 2], 'samples': samples}
+
+
+def bench_orbit_evolve(quick):
+    t = np.linspace(0.0, 20.0, 1000)
+    init = OrderedDict([('x', -0.8), ('y', 0.5)])
+    for method in ('odeint', 'LSODA', 'RK45', 'rk45'):
+        orb = Orbit(init, compact_dyn_sys_phi2, [], t, integrator=method,
+                    constraints=[Ball(range(2))])
+
+        def run(state, orb=orb):
+            orb.invalidate()
+            orb.evolve()
+        yield 'orbit_evolve', {'integrator': method, 'n_t': len(t)}, run, None
+
+
+def bench_ensemble(quick):
+    sizes = (10, 100, 1000) if quick else (10, 100, 1000, 10000, 100000)
+    t = np.linspace(0.0, 2.0, 50)
+    for n in sizes:
+        inits = yukawa_inits(n)
+        for method in ('rk4', 'rk45'):
+            def run(state, inits=inits, method=method):
+                ensemble.integrate(dyn_sys_exp_yukawa_bounded, inits, t,
+                                   model_pars=YUKAWA_PARS, method=method)
+            yield 'ensemble', {'n_orbits': n, 'method': method, 'n_t': len(t)}, run, None
+
+
+def _dynsys(model, model_pars, inits, t, Ndim):
+    names = ['v{}'.format(i) for i in range(Ndim)]
+    orbits = [{'vars': OrderedDict(zip(names, p)), 't': t, 'arrow_pos': [len(t) // 2],
+               'label': 'orbit_{}'.format(i)} for i, p in enumerate(inits)]
+    return BaseDynSys(model=model, model_pars=model_pars,
+                      var_names=dict((k, k) for k in names), Ndim=Ndim,
+                      orbits=orbits, integrator='rk45')
+
+
+def bench_vector_field(quick):
+    sizes = (64, 256) if quick else (64, 256, 1024)
+    t = np.linspace(0.0, 1.0, 10)
+    ds = _dynsys(compact_dyn_sys_phi2, [], phi2_inits(1), t, 2)
+    for n in sizes:
+        def run(state, n=n):
+            ds.clear_cache()
+            ds.vector_field((-1.0, 1.0, n))
+        yield 'vector_field', {'model': 'compact_dyn_sys_phi2', 'grid': n}, run, None
+
+
+def bench_flow(quick):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    t = np.linspace(0.0, 20.0, 1000)
+    orb = Orbit(OrderedDict([('x', -0.8), ('y', 0.5)]), compact_dyn_sys_phi2, [], t,
+                integrator='rk45', constraints=[Ball(range(2))])
+    orb.evolve()
+    for n_arrows in (10, 100, 1000):
+        flow_index = list(np.linspace(0, len(orb.solution) - 1, n_arrows).astype(int))
+
+        def run(state, flow_index=flow_index):
+            fig, ax = plt.subplots()
+            orb.plot_flow_over_orbit(ax, ['x', 'y'], flow_index=flow_index)
+            plt.close(fig)
+        yield 'flow', {'kind': 'orbit', 'n_arrows': n_arrows}, run, None
+
+    n_orbits = 20 if quick else 200
+    ds = _dynsys(compact_dyn_sys_phi2, [], phi2_inits(n_orbits), t, 2)
+    ds.evolve_all(n_workers=1)
+
+    def run(state):
+        fig, ax = plt.subplots()
+        ds.plot_orbits(ax, ['v0', 'v1'], add_legend=False)
+        plt.close(fig)
+    yield 'flow', {'kind': 'plot_orbits', 'n_orbits': n_orbits}, run, None
+
+
+def bench_triangle(quick):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    n_orbits = 20 if quick else 200
+    t = np.linspace(0.0, 5.0, 200)
+    for Ndim in (3, 4, 5, 6):
+        model, inits = product_model(Ndim)
+        pars = YUKAWA_PARS if Ndim == 3 else []
+
+        def setup(model=model, inits=inits, pars=pars, Ndim=Ndim):
+            return _dynsys(model, pars, inits(n_orbits), t, Ndim)
+
+        def run(ds):
+            ds.triangle()
+            plt.close('all')
+        yield 'triangle', {'Ndim': Ndim, 'n_orbits': n_orbits}, run, setup
+
+
+BENCHMARKS = OrderedDict([('orbit_evolve', bench_orbit_evolve),
+                          ('ensemble', bench_ensemble),
+                          ('vector_field', bench_vector_field),
+                          ('flow', bench_flow),
+                          ('triangle', bench_triangle)])
+
+
+def git_commit():
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                      cwd=ROOT, stderr=subprocess.DEVNULL)
+        return out.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _selected(group, selected):
+    """True without -k, or when one of the -k strings is part of group."""
+    return not selected or any(k in group for k in selected)
+
+
+def run_all(selected, quick, repeat):
+    results = []
+    for group, bench in BENCHMARKS.items():
+        if not _selected(group, selected):
+            continue
+        for name, params, func, setup in bench(quick):
+            entry = {'name': name, 'params': params}
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    entry.update(timeit(func, setup, repeat))
+            except Exception as e:
+                entry['error'] = '{}: {}'.format(type(e).__name__, e)
+            results.append(entry)
+            print(_format(entry))
+    if _selected('import', selected):
+        entry = bench_import.run(repeat)
+        entry.update(name='import', params={})
+        results.append(entry)
+        print(_format(entry))
+    return results
+
+
+def _key(entry):
+    return (entry['name'], json.dumps(entry['params'], sort_keys=True))
+
+
+def _format(entry):
+    params = ', '.join('{}={}'.format(k, v) for k, v in sorted(entry['params'].items()))
+    if 'error' in entry:
+        return '{:<14} {:<40} ERROR {}'.format(entry['name'], params, entry['error'])
+    return '{:<14} {:<40} {:10.4f} s'.format(entry['name'], params, entry['best'])
+
+
+def compare(old_file, new_file):
+    """Print the ratio new/old of the best times of the common benchmarks."""
+    with open(old_file) as f:
+        old = dict((_key(e), e) for e in json.load(f)['results'])
+    with open(new_file) as f:
+        new = json.load(f)['results']
+    for entry in new:
+        before = old.get(_key(entry))
+        line = _format(entry)
+        if before is not None and 'best' in before and 'best' in entry:
+            line += '   x{:.2f} vs {:.4f} s'.format(entry['best'] / before['best'],
+                                                  before['best'])
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pyncare benchmarks')
+    parser.add_argument('-k', dest='select', action='append', default=[],
+                        help='run only the benchmarks whose name contains this')
+    parser.add_argument('--quick', action='store_true', help='smaller sizes')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None,
+                        help='JSON file (default benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+    commit = git_commit()
+    results = run_all(args.select, args.quick, args.repeat)
+    report = {'commit': commit,
+              'date': datetime.datetime.now().isoformat(),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'machine': platform.platform(),
+              'quick': args.quick,
+              'results': results}
+    output = args.output
+    if output is None:
+        output = os.path.join(ROOT, 'benchmarks', 'results', '{}.json'.format(commit))
+    if not os.path.isdir(os.path.dirname(os.path.abspath(output))):
+        os.makedirs(os.path.dirname(os.path.abspath(output)))
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print('results written to {}'.format(output))
+
+
+if __name__ == "__main__":
+    main()
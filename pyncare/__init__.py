@@ -2,7 +2,7 @@ from poincare import PoincareCompact
 from dynsysbase import BaseDynSys
 import utils as utils
 import models as models
-import contraints as constraints
+import constraints as constraints
 
 __version__ = '0.1'
 __author__ = 'Efrain Torres-Lomas'
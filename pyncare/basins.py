@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        basins.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: Basins of attraction. Grids of initial conditions are
+             integrated as one batch and every orbit stops as soon as it
+             enters the neighbourhood of a known attractor. Maps start on a
+             coarse grid and only the cells along basin boundaries are
+             split (quadtree/octree-style) level after level.
+
+             Labels: i + 1 for the i-th attractor, 0 when no attractor was
+             reached before t_max, -1 when the orbit left the constraints
+             (or stopped being finite).
+"""
+import collections
+import numpy as np
+from scipy.spatial import cKDTree
+from constraints import inside_all
+from ensemble import batch_rhs, _stack
+
+BasinMap = collections.namedtuple('BasinMap', ['labels', 'axes', 'attractors', 'n_orbits'])
+
+UNDECIDED = 0
+ESCAPED = -1
+
+
+def classify(model, inits, attractors, radius=1e-2, model_pars=[], t_max=100.0,
+             dt=1e-2, check_every=10, constraints=None):
+    """Label of the attractor reached by each orbit starting at inits (N, Ndim).
+
+    Orbits are advanced together with RK4 steps dt; every check_every
+    steps those closer than radius to an attractor (or out of the
+    constraints) leave the batch.
+    """
+    y = _stack(inits).copy()
+    labels = np.full(len(y), UNDECIDED, dtype=int)
+    tree = cKDTree(np.atleast_2d(np.asarray(attractors, dtype=float)))
+    f = batch_rhs(model, model_pars)
+    active = np.arange(len(y))
+    t = 0.0
+    n_steps = int(np.ceil(t_max / dt))
+    with np.errstate(all='ignore'):
+        for n in range(n_steps + 1):
+            if n % check_every == 0 or n == n_steps:
+                ok = np.all(np.isfinite(y), axis=1)
+                if constraints:
+                    ok &= inside_all(constraints, y.T)
+                labels[active[~ok]] = ESCAPED
+                distance, nearest = tree.query(np.where(ok[:, np.newaxis], y, 0.0),
+                                               distance_upper_bound=radius)
+                hit = ok & np.isfinite(distance)
+                labels[active[hit]] = nearest[hit] + 1
+                keep = ok & ~hit
+                active, y = active[keep], y[keep]
+            if active.size == 0 or n == n_steps:
+                break
+            k1 = f(t, y)
+            k2 = f(t + 0.5 * dt, y + 0.5 * dt * k1)
+            k3 = f(t + 0.5 * dt, y + 0.5 * dt * k2)
+            k4 = f(t + dt, y + dt * k3)
+            y = y + dt / 6.0 * (k1 + 2.0 * k2 + 2.0 * k3 + k4)
+            t = t + dt
+    return labels
+
+
+def _states(index, m, bounds, base_state, axes_index):
+    """Initial conditions at the centres of the cells index (n, d) of an m grid."""
+    states = np.tile(np.asarray(base_state, dtype=float), (len(index), 1))
+    for k, (lo, hi) in enumerate(bounds):
+        states[:, axes_index[k]] = lo + (index[:, k] + 0.5) * (hi - lo) / m
+    return states
+
+
+def _boundary(labels):
+    """Cells whose label differs from one of their neighbours along an axis."""
+    edge = np.zeros(labels.shape, dtype=bool)
+    for axis in range(labels.ndim):
+        differ = np.diff(labels, axis=axis) != 0
+        lo = [slice(None)] * labels.ndim
+        hi = [slice(None)] * labels.ndim
+        lo[axis] = slice(None, -1)
+        hi[axis] = slice(1, None)
+        edge[tuple(lo)] |= differ
+        edge[tuple(hi)] |= differ
+    return edge
+
+
+def basin_map(model, attractors, bounds, axes_index, base_state, n_coarse=64,
+              levels=4, model_pars=[], **options):
+    """Map of the basins over a 2D or 3D grid of initial conditions.
+
+    bounds are the (min, max) of the varying variables, at positions
+    axes_index of the state; the other variables take the values of
+    base_state. The coarse n_coarse**d grid is refined `levels` times
+    along the basin boundaries, giving a raster of (n_coarse * 2**levels)
+    cells per axis. options are passed to classify(). Returns
+    BasinMap(labels, axes, attractors, n_orbits): labels[i, j(, k)] is
+    the label of the cell at axes[0][i], axes[1][j](, axes[2][k]), axes
+    being the cell centres of the final raster, and n_orbits the number
+    of orbits integrated.
+    """
+    d = len(bounds)
+    if d not in (2, 3) or len(axes_index) != d:
+        raise ValueError("basin_map needs 2 or 3 varying variables")
+    attractors = np.atleast_2d(np.asarray(attractors, dtype=float))
+    dtype = np.int8 if len(attractors) < 127 else np.int16
+
+    m = n_coarse
+    index = np.indices((m,) * d).reshape(d, -1).T
+    labels = classify(model, _states(index, m, bounds, base_state, axes_index),
+                      attractors, model_pars=model_pars, **options)
+    labels = labels.astype(dtype).reshape((m,) * d)
+    n_orbits = labels.size
+    for level in range(levels):
+        edge = _boundary(labels)
+        for axis in range(d):                   # each cell -> 2**d children
+            labels = np.repeat(labels, 2, axis=axis)
+            edge = np.repeat(edge, 2, axis=axis)
+        m *= 2
+        index = np.argwhere(edge)
+        if len(index):
+            new = classify(model, _states(index, m, bounds, base_state, axes_index),
+                           attractors, model_pars=model_pars, **options)
+            labels[tuple(index.T)] = new
+            n_orbits += len(index)
+    axes = [lo + (np.arange(m) + 0.5) * (hi - lo) / m for lo, hi in bounds]
+    return BasinMap(labels=labels, axes=axes, attractors=attractors, n_orbits=n_orbits)
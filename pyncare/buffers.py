@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        buffers.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: Preallocated arrays growing geometrically along the first
+             axis, used to stream results of unknown length.
+"""
+import numpy as np
+
+
+class GrowableArray(object):
+    """Array of rows with amortized O(1) append."""
+
+    def __init__(self, row_shape=(), dtype=float, capacity=1024, growth=2.0):
+        self.row_shape = tuple(row_shape)
+        self.growth = growth
+        self._data = np.empty((max(int(capacity), 1),) + self.row_shape, dtype=dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def data(self):
+        """View of the filled rows (invalidated by the next reallocation)."""
+        return self._data[:self.size]
+
+    @property
+    def capacity(self):
+        return self._data.shape[0]
+
+    def reserve(self, n):
+        """Make room for at least n rows."""
+        if n <= self.capacity:
+            return
+        new_capacity = self.capacity
+        while new_capacity < n:
+            new_capacity = int(np.ceil(new_capacity * self.growth))
+        new = np.empty((new_capacity,) + self.row_shape, dtype=self._data.dtype)
+        new[:self.size] = self._data[:self.size]
+        self._data = new
+
+    def append(self, row):
+        self.reserve(self.size + 1)
+        self._data[self.size] = row
+        self.size += 1
+
+    def extend(self, rows):
+        rows = np.asarray(rows, dtype=self._data.dtype)
+        n = rows.shape[0]
+        self.reserve(self.size + n)
+        self._data[self.size:self.size + n] = rows
+        self.size += n
+
+    def clear(self):
+        self.size = 0
+
+    def trim(self):
+        """Return a compact copy of the filled rows."""
+        return self.data.copy()
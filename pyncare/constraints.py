@@ -35,3 +35,90 @@ def plot_cylinder(ax, z_min=-1.0, z_max=0.5, color='r', alpha=0.2):
     #                 linewidth=0.0, alpha=0.2, antialiased=False)
     ax.plot_surface(Xc, Yc, Zc, color=color, rstride=20, cstride=5,
                     linewidth=0.0, alpha=alpha, antialiased=False)
+
+
+class Constraint(object):
+    """Physical region of the phase space, the states where g(state) >= 0.
+
+    g takes states of shape (Ndim, ...). Leaving the region (or reaching a
+    non finite state) stops the integration of an orbit, see event().
+    """
+
+    def __init__(self, func, name='constraint'):
+        self.func = func
+        self.name = name
+
+    def __call__(self, states):
+        return np.asarray(self.func(np.asarray(states, dtype=float)), dtype=float)
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, self.name)
+
+    def inside(self, states):
+        """Boolean mask of the states satisfying the constraint."""
+        with np.errstate(invalid='ignore'):
+            return self(states) >= 0.0  # NaN is outside
+
+    def event(self):
+        """Terminal event function for scipy.integrate.solve_ivp."""
+        def event(t, y):
+            g = self(y)
+            return g if np.isfinite(g) else -1.0
+        event.terminal = True
+        event.direction = -1
+        return event
+
+
+class Ball(Constraint):
+    """Ball |x| <= r - margin in the variables at positions index.
+
+    Ball([0, 1]) is the unit disk of PoincareCompact, where the compact
+    variables satisfy X**2 + Y**2 + Z**2 = 1.
+    """
+
+    def __init__(self, index, r=1.0, margin=0.0):
+        self.index = list(index)
+        self.r = r
+        self.margin = margin
+        super(Ball, self).__init__(self._g, name='ball index={} r={} margin={}'.format(self.index, r, margin))
+
+    def _g(self, states):
+        rho2 = np.sum(states[self.index]**2.0, axis=0)
+        return (self.r - self.margin)**2.0 - rho2
+
+
+class Cylinder(Constraint):
+    """Cylinder of radius r around the variable `axis`, z_min <= z <= z_max.
+
+    index are the positions of the two variables spanning the disk.
+    """
+
+    def __init__(self, index, axis, r=1.0, z_min=-1.0, z_max=0.5):
+        self.index = list(index)
+        self.axis = axis
+        self.r = r
+        self.z_min = z_min
+        self.z_max = z_max
+        super(Cylinder, self).__init__(self._g, name='cylinder index={} axis={} r={} z={}..{}'.format(
+            self.index, axis, r, z_min, z_max))
+
+    def _g(self, states):
+        rho2 = np.sum(states[self.index]**2.0, axis=0)
+        z = states[self.axis]
+        return np.minimum(self.r**2.0 - rho2, np.minimum(z - self.z_min, self.z_max - z))
+
+
+def inside_all(constraints, states):
+    """Mask of the states satisfying every constraint (and finite)."""
+    states = np.asarray(states, dtype=float)
+    mask = np.all(np.isfinite(states), axis=0)
+    for c in constraints:
+        mask &= c.inside(states)
+    return mask
+
+
+def valid_length(solution, constraints):
+    """Number of leading rows of solution (N_t, Ndim) inside the constraints."""
+    ok = inside_all(constraints, np.asarray(solution).T)
+    bad = np.flatnonzero(~ok)
+    return len(ok) if bad.size == 0 else bad[0]
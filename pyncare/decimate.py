@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        decimate.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: Level of detail for long trajectories. Before plotting, the
+             rows of a solution are reduced to the ones that can be seen at
+             the resolution of the axes:
+
+                 'minmax'   the rows are split in consecutive buckets (four
+                            per pixel column by default) and each bucket
+                            keeps its first and last rows and the rows with
+                            the min and max of every plotted column
+                            (M4-style, cost O(N))
+                 'exact'    Ramer-Douglas-Peucker with a tolerance of a
+                            quarter of a pixel: the decimated curve never
+                            departs visibly from the original one, so slow
+                            approaches to fixed points and thin spirals
+                            are kept
+
+             Both return the indexes of the kept rows, always including
+             the first and the last one.
+"""
+import numpy as np
+
+MODES = ('minmax', 'exact')
+BUCKETS_PER_PIXEL = 4       # 'minmax'
+TOLERANCE = 0.25            # 'exact', in pixels
+
+
+def minmax(points, n_buckets):
+    """Indexes of the first, last, min and max rows of n_buckets buckets.
+
+    points is (N, d); at most n_buckets * (2 * d + 2) rows are kept.
+    """
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+    if n_buckets < 1 or n <= n_buckets * (2 * points.shape[1] + 2):
+        return np.arange(n)
+    size = int(np.ceil(n / float(n_buckets)))
+    n_buckets = int(np.ceil(n / float(size)))
+    padded = np.empty((n_buckets * size,) + points.shape[1:])
+    padded[:n] = points
+    padded[n:] = points[-1]                 # repeating the last row is harmless
+    buckets = padded.reshape(n_buckets, size, -1)
+    start = np.arange(n_buckets) * size
+    lowest = np.argmin(buckets, axis=1)      # (n_buckets, d), a nan wins
+    highest = np.argmax(buckets, axis=1)
+    kept = [start, np.minimum(start + size - 1, n - 1)]
+    kept += [start + lowest[:, k] for k in range(points.shape[1])]
+    kept += [start + highest[:, k] for k in range(points.shape[1])]
+    return np.unique(np.minimum(np.concatenate(kept), n - 1))
+
+
+def _distance2(points, a, b):
+    """Squared distance from points (n, d) to the segment a-b."""
+    rel = points - a
+    ab = b - a
+    length2 = np.dot(ab, ab)
+    if length2 > 0.0:
+        s = np.clip(np.dot(rel, ab) / length2, 0.0, 1.0)
+        rel -= s[:, np.newaxis] * ab
+    return np.einsum('ij,ij->i', rel, rel)
+
+
+def rdp(points, tolerance=1.0):
+    """Indexes kept by Ramer-Douglas-Peucker on points (N, d).
+
+    Every dropped row lies within tolerance of the polyline of the kept
+    ones. Rows that are not finite are kept (they break the line).
+    """
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return np.flatnonzero(keep)
+    keep[[0, -1]] = True
+    finite = np.all(np.isfinite(points), axis=1)
+    keep[~finite] = True
+    bounds = np.flatnonzero(keep)
+    stack = [(i, j) for i, j in zip(bounds[:-1], bounds[1:]) if finite[i] and finite[j]]
+    tolerance2 = tolerance**2
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        d2 = _distance2(points[i + 1:j], points[i], points[j])
+        k = int(np.argmax(d2))
+        if d2[k] > tolerance2:
+            k += i + 1
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+    return np.flatnonzero(keep)
+
+
+def pixel_size(ax, points):
+    """Data units per pixel along each column of points (N, 2) when their
+    extent fills ax."""
+    box = ax.get_window_extent()
+    pixels = np.array([box.width, box.height], dtype=float)
+    span = np.nanmax(points, axis=0) - np.nanmin(points, axis=0)
+    return np.where(span > 0, span, 1.0) / np.maximum(pixels, 1.0)
+
+
+def resolution_key(ax, points, mode, max_points):
+    """Cache key of a decimation: the view resolution it was made for."""
+    if max_points is not None:
+        return (mode, int(max_points))
+    box = ax.get_window_extent()
+    if mode == 'minmax':
+        return (mode, int(round(box.width)))
+    size = pixel_size(ax, points[:, :2])
+    return (mode, tuple(float('{:.3g}'.format(s)) for s in size))
+
+
+def reduce(ax, points, mode='minmax', max_points=None):
+    """Indexes of the rows of points (N, d) to draw in ax.
+
+    max_points bounds the number of rows kept by 'minmax' (default: four
+    buckets per pixel column of ax); for 'exact' it sets the tolerance to
+    the extent of the data over max_points instead of the pixel size.
+    """
+    points = np.asarray(points, dtype=float)
+    if mode == 'minmax':
+        if max_points is None:
+            n_buckets = BUCKETS_PER_PIXEL * int(round(ax.get_window_extent().width))
+        else:
+            n_buckets = int(max_points) // (2 * points.shape[1] + 2)
+        return minmax(points, max(n_buckets, 1))
+    if mode == 'exact':
+        if max_points is None:
+            size = pixel_size(ax, points[:, :2])
+            size = np.concatenate([size, np.full(points.shape[1] - 2, size.min())])
+        else:
+            span = np.nanmax(points, axis=0) - np.nanmin(points, axis=0)
+            size = np.where(span > 0, span, 1.0) / float(max_points)
+        return rdp(points / size, tolerance=TOLERANCE)
+    raise ValueError("decimate must be one of {}, not {!r}".format(MODES, mode))
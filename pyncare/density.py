@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        density.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: Density images of huge ensembles. Instead of one line per
+             orbit, trajectories (or section points) are accumulated chunk
+             by chunk into a fixed 2D histogram:
+
+                 lines    each segment adds samples about one pixel apart,
+                          the image is the length of trajectory per pixel
+                 points   each point adds one count
+
+             Memory and drawing time depend on the number of bins only; the
+             histogram is shown with imshow.
+"""
+import numpy as np
+
+
+class Density(object):
+    """2D histogram of shape bins = (nx, ny) over extent (xmin, xmax, ymin, ymax)."""
+
+    def __init__(self, extent, bins=(512, 512)):
+        self.extent = tuple(float(e) for e in extent)
+        if self.extent[1] <= self.extent[0] or self.extent[3] <= self.extent[2]:
+            raise ValueError("empty extent {}".format(self.extent))
+        if np.isscalar(bins):
+            bins = (bins, bins)
+        self.bins = (int(bins[0]), int(bins[1]))
+        self.counts = np.zeros(self.bins[0] * self.bins[1])
+        self._scale = (self.bins[0] / (self.extent[1] - self.extent[0]),
+                       self.bins[1] / (self.extent[3] - self.extent[2]))
+
+    def _pixels(self, x, y):
+        return ((np.asarray(x, dtype=float) - self.extent[0]) * self._scale[0],
+                (np.asarray(y, dtype=float) - self.extent[2]) * self._scale[1])
+
+    def _add_pixels(self, px, py, weights=None):
+        inside = (px >= 0) & (px < self.bins[0]) & (py >= 0) & (py < self.bins[1])
+        flat = py[inside].astype(np.intp) * self.bins[0] + px[inside].astype(np.intp)
+        if weights is not None:
+            weights = weights[inside]
+        self.counts += np.bincount(flat, weights=weights, minlength=self.counts.size)
+
+    def add_points(self, x, y, weights=None):
+        """Count the points (x, y); non finite ones and those out of extent
+        are dropped."""
+        px, py = self._pixels(np.ravel(x), np.ravel(y))
+        if weights is not None:
+            weights = np.ravel(weights)
+        self._add_pixels(px, py, weights)
+
+    def add_lines(self, x, y, max_samples=4096):
+        """Add the polylines given by the rows of x, y (n_lines, n_points).
+
+        Segments with a non finite end are skipped; every segment gets
+        samples at most a pixel apart (at most max_samples per segment).
+        """
+        px, py = self._pixels(np.atleast_2d(x), np.atleast_2d(y))
+        x0, y0 = px[:, :-1].ravel(), py[:, :-1].ravel()
+        dx, dy = px[:, 1:].ravel() - x0, py[:, 1:].ravel() - y0
+        ok = np.isfinite(x0) & np.isfinite(y0) & np.isfinite(dx) & np.isfinite(dy)
+        x0, y0, dx, dy = x0[ok], y0[ok], dx[ok], dy[ok]
+        n = np.minimum(np.ceil(np.maximum(np.abs(dx), np.abs(dy))), max_samples)
+        n = np.maximum(n, 1).astype(np.intp)
+        segment = np.repeat(np.arange(len(n)), n)
+        first = np.cumsum(n) - n
+        s = (np.arange(segment.size) - first[segment] + 0.5) / n[segment]
+        length = np.hypot(dx / self._scale[0], dy / self._scale[1]) / n
+        self._add_pixels(x0[segment] + s * dx[segment], y0[segment] + s * dy[segment],
+                         length[segment])
+
+    def image(self):
+        """Counts as an (ny, nx) array, for imshow(origin='lower')."""
+        return self.counts.reshape(self.bins[1], self.bins[0])
+
+    def show(self, ax, log=True, cmap='viridis', **kwargs):
+        """imshow the histogram on ax, empty bins transparent."""
+        from matplotlib.colors import LogNorm
+        image = np.ma.masked_less_equal(self.image(), 0.0)
+        norm = None
+        if log and image.count():
+            norm = LogNorm(vmin=image.min(), vmax=image.max())
+        return ax.imshow(image, extent=self.extent, origin='lower', cmap=cmap,
+                         norm=norm, aspect='auto', interpolation='nearest', **kwargs)
+
+
+def bounds(x, y, margin=0.05):
+    """Extent (xmin, xmax, ymin, ymax) of the finite points, with margin."""
+    extent = []
+    for v in (np.ravel(x), np.ravel(y)):
+        v = v[np.isfinite(v)]
+        lo, hi = (v.min(), v.max()) if v.size else (-1.0, 1.0)
+        pad = margin * (hi - lo) if hi > lo else 0.5
+        extent += [lo - pad, hi + pad]
+    return tuple(extent)
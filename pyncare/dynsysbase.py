@@ -7,16 +7,33 @@ Email:       efrain@fisica.ugto.mx
 Github:      https://github.com/elchinot7
 Description: ToDo
 """
+import os
 import numpy as np
-import matplotlib.pyplot as plt
 from itertools import cycle
 import sys
-import orbit
+from orbitset import OrbitSet
+from orbit import solver_key
+import ensemble
+from constraints import inside_all, valid_length
+import parallel
+import fixedpoints
+import lyapunov
+import basins
+import store
+import sweep
+import triangle as tri
+import profiling
+from density import Density, bounds
+import section as sections
+from section import poincare_section
+from protocol import batch_model
 import collections
 import warnings
 
 _DEBUG = False
 
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'orbits'])
+
 
 class BaseDynSys(object):
     """Generic Dynamical System."""
@@ -26,10 +43,14 @@ class BaseDynSys(object):
                  model_pars=[],
                  var_names=None,  # Dictionary
                  Ndim=None,       # Int
-                 orbits=None,     # orbits = [{'vars': OrderedDict([('x', -0.8), ('y', y0)]), 't': t, 'arrow_pos': [1, 100, 200], 'label': 'label0'},]
+                 orbits=None,     # orbits = [{'vars': OrderedDict([('x', -0.8), ('y', y0)]), 't': t, 'arrow_pos': [1, 100, 200], 'label': 'label0'},] or an OrbitSet
                  t=None,          # numpy.linspace
                  lines=None,      # List of strings
                  colors=None,     # Color scheme name
+                 integrator='odeint',       # see integrators.METHODS
+                 integrator_options=None,   # Dictionary passed to the solver
+                 dense_output=False,
+                 constraints=None,          # List of constraints.Constraint
                  ):
         _color_schemes = {'deep': ["#4C72B0", "#55A868", "#C44E52",
                                    "#8172B2", "#CCB974", "#64B5CD"],
@@ -50,6 +71,11 @@ class BaseDynSys(object):
 
         self.model_pars = model_pars
 
+        self.integrator = integrator
+        self.integrator_options = integrator_options
+        self.dense_output = dense_output
+        self.constraints = constraints
+
         if Ndim is not None:
             self.Ndim = Ndim
         else:
@@ -68,6 +94,13 @@ class BaseDynSys(object):
         else:
             sys.exit("The orbits settings must be defined.")
 
+        if isinstance(self.orbits, OrbitSet):
+            self.orbit_set = self.orbits
+        else:
+            self.orbit_set = OrbitSet.from_dicts(self.orbits)
+        self.names = self.orbit_set.names  # ordered variables
+        self._field_cache = {}
+
         # if t is not None:
         #     self.t = t
         # else:
@@ -88,21 +121,18 @@ class BaseDynSys(object):
                          [None, 'deep', 'muted', 'pastel', 'bright', 'dark', \
                          'colorblind', 'black']")
 
-        # If all went well, create the Orbit Objects:
-        self._Orbits = []  # To be filled with Orbits instances
-        for orb in self.orbits:
-            d0 = collections.OrderedDict()  # must be an collections.OrderedDict
-            for key, value in orb['vars'].items():  # fill the initial data
-                d0[key] = value
-            # print d0
-            t = orb['t']                    # time to evolve the orbit
-            label = orb['label']
-            _Orbit = orbit.Orbit(init_cond=d0,
-                                 model=self.model,
+        # If all went well, the Orbit objects are built on demand:
+        self.orbit_set.configure(model=self.model,
                                  model_pars=self.model_pars,
-                                 t=t,
-                                 label=label)
-            self._Orbits.append(_Orbit)          # list full of <orbit.Orbit> instances
+                                 integrator=self.integrator,
+                                 integrator_options=self.integrator_options,
+                                 dense_output=self.dense_output,
+                                 constraints=self.constraints)
+
+    @property
+    def _Orbits(self):
+        """The orbits as a sequence of <orbit.Orbit>, see OrbitSet."""
+        return self.orbit_set
 
     def __str__(self):
         return self.out_info()
@@ -127,11 +157,270 @@ class BaseDynSys(object):
         #             s += '{}={}, '.format(key, value)
         #         out += '\t[{}]\n'.format(s)
         out += 'List of defined orbist:\n'
-        for orb in self._Orbits:
-            out += ' > {}\n'.format(orb.__str__())
+        orbits = self.orbit_set
+        for label, init in zip(orbits.labels, orbits.inits.tolist()):
+            out += ' > {} is an Orbit object with init cond: {} = {}\n'.format(
+                label, orbits.names, init)
         out += '\n=====================================\n'
         return out
 
+    def evaluate(self, states, t=None):
+        """Evaluate the model over states of shape (Ndim, ...) in one call."""
+        return batch_model(self.model, self.model_pars)(states, t)
+
+    @profiling.timed('vector_field')
+    def vector_field(self, grid_spec, vars=None, fixed=None):
+        """Evaluate the model on a meshgrid of 2 or 3 variables.
+
+        grid_spec is (min, max, n) for all the variables in vars, or a
+        dictionary {var: (min, max, n)}. The other variables take the values
+        in `fixed` (default 0.0). The model is evaluated once over the whole
+        grid. Points outside the constraints are masked. Returns
+        (X, Y, U, V) or (X, Y, Z, U, V, W), ready for ax.quiver(*field) or
+        ax.streamplot(*field). Results are cached by grid spec.
+        """
+        if vars is None:
+            vars = self.names[:2]
+        if len(vars) not in (2, 3):
+            sys.exit("vector_field needs 2 or 3 vars")
+        if not all(key in self.names for key in vars):
+            sys.exit("vars are not a subset of vars")
+        if fixed is None:
+            fixed = dict()
+        if not isinstance(grid_spec, dict):
+            grid_spec = dict((key, grid_spec) for key in vars)
+        spec = tuple((key, tuple(grid_spec[key])) for key in vars)
+
+        key = (spec, tuple(sorted(fixed.items())), self.model,
+               tuple(self.model_pars), tuple(self.constraints or []))
+        if key in self._field_cache:
+            profiling.count('vector_field.cache_hits')
+            return self._field_cache[key]
+
+        axes = [np.linspace(*s) for _, s in spec]
+        grids = np.meshgrid(*axes)
+        states = np.empty((self.Ndim,) + grids[0].shape)
+        for i, name in enumerate(self.names):
+            states[i] = fixed.get(name, 0.0)
+        for key_var, grid in zip(vars, grids):
+            states[self.names.index(key_var)] = grid
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            vels = self.evaluate(states)
+        outside = ~inside_all(self.constraints or [], states)
+        field = list(grids)
+        for key_var in vars:
+            field.append(np.ma.masked_where(outside, vels[self.names.index(key_var)]))
+        field = tuple(field)
+        self._field_cache[key] = field
+        return field
+
+    def fixed_points(self, bounds=None, n_seeds=200, jacobian=None, **options):
+        """Critical points inside bounds and constraints, with their stability.
+
+        bounds is a list of (min, max) per variable, [-1, 1] by default as
+        for bounded/compact variables. See fixedpoints.find_fixed_points.
+        """
+        if bounds is None:
+            bounds = [(-1.0, 1.0)] * self.Ndim
+        return fixedpoints.find_fixed_points(self.model, bounds,
+                                             model_pars=self.model_pars,
+                                             n_seeds=n_seeds, jacobian=jacobian,
+                                             constraints=self.constraints,
+                                             **options)
+
+    def basins(self, grid_spec, vars=None, fixed=None, attractors=None,
+               radius=1e-2, levels=4, **options):
+        """Basins of attraction over a grid of 2 or 3 variables.
+
+        grid_spec is (min, max, n_coarse) for all the variables in vars, or
+        a dictionary {var: (min, max, n_coarse)} with a common n_coarse; the
+        other variables take the values in `fixed` (default 0.0). By
+        default the attractors are the stable fixed points. See
+        basins.basin_map for the refinement and the labels.
+        """
+        if vars is None:
+            vars = self.names[:2]
+        if len(vars) not in (2, 3):
+            sys.exit("basins needs 2 or 3 vars")
+        if not all(key in self.names for key in vars):
+            sys.exit("vars are not a subset of vars")
+        if fixed is None:
+            fixed = dict()
+        if not isinstance(grid_spec, dict):
+            grid_spec = dict((key, grid_spec) for key in vars)
+        if len(set(int(grid_spec[key][2]) for key in vars)) != 1:
+            sys.exit("basins needs the same number of cells for all the vars")
+        if attractors is None:
+            attractors = [fp.point for fp in self.fixed_points()
+                          if fp.kind.startswith('stable')]
+        if len(attractors) == 0:
+            sys.exit("basins found no attractor, give them explicitly")
+        base_state = [fixed.get(name, 0.0) for name in self.names]
+        return basins.basin_map(self.model, attractors,
+                                [grid_spec[key][:2] for key in vars],
+                                [self.names.index(key) for key in vars],
+                                base_state, n_coarse=int(grid_spec[vars[0]][2]),
+                                levels=levels, model_pars=self.model_pars,
+                                radius=radius, constraints=self.constraints,
+                                **options)
+
+    def lyapunov_spectra(self, t_max=None, **options):
+        """Lyapunov exponents of all the orbits, integrated as one batch.
+
+        t_max defaults to the longest time grid of the orbits. Returns a
+        lyapunov.Lyapunov with exponents of shape (N_orbits, k), see
+        lyapunov.lyapunov_spectrum for the options (callback, history...).
+        """
+        if t_max is None:
+            t_max = max(abs(t[-1] - t[0]) for t in self.orbit_set.grids)
+        options.setdefault('constraints', self.constraints)
+        return lyapunov.lyapunov_spectrum(self.model, self.orbit_set.inits, t_max,
+                                          model_pars=self.model_pars, **options)
+
+    def sweep(self, param_grid, path, summaries=None, method='rk45',
+              chunk_size=100, n_workers=None, **options):
+        """Run a sweep.Sweep of the orbits' initial conditions over model_pars.
+
+        All the orbits must share the time grid. Results are written
+        under path and returned as {summary: array (n_points, N_orbits, ...)}.
+        """
+        if len(self.orbit_set.grids) != 1:
+            sys.exit("sweep needs all the orbits on the same time grid")
+        t = self.orbit_set.grids[0]
+        s = sweep.Sweep(self.model, param_grid, self.orbit_set.inits, t, summaries=summaries,
+                        method=method, integrator_options=options,
+                        constraints=self.constraints)
+        return s.run(path, chunk_size=chunk_size, n_workers=n_workers)
+
+    @profiling.timed('evolve_ensemble')
+    def evolve_ensemble(self, method='rk45', pending=False, **options):
+        """Integrate all the orbits together with a batched integrator.
+
+        Orbits sharing the same time grid are stacked in one state array
+        and advanced at once (see ensemble.py). The solutions of each group
+        land in a contiguous (N_orbits, N_t, Ndim) array and every
+        Orbit.solution is a view into it. Orbits leaving the constraints
+        stop early, their views are truncated. Unless method and options
+        are the integrator settings of the orbits, Orbit.evolve() and
+        evolve_all() do not take these solutions as theirs. With pending
+        only the orbits without a valid solution are integrated (the other
+        slabs are kept). Returns the list of (orbit indexes, solution array)
+        pairs, one per time grid.
+        """
+        if pending:
+            index = self.orbit_set.pending()
+        else:
+            index = None
+            self.orbit_set.clear_slabs()
+        for index, t in self.orbit_set.groups(index):
+            slab = ensemble.integrate(self.model, self.orbit_set.inits[index], t,
+                                      model_pars=self.model_pars,
+                                      method=method,
+                                      constraints=self.constraints, **options)
+            self.orbit_set.add_slab(index, slab,
+                                    solver=solver_key(method, options, False))
+        return self.orbit_set.slabs
+
+    @profiling.timed('evolve_all')
+    def evolve_all(self, n_workers=None, chunksize=None, store_path=None):
+        """Evolve all the orbits not yet solved in a pool of processes.
+
+        The orbits keep their order; the failure of an orbit is raised as
+        a parallel.EvolveError carrying the orbit label. With n_workers=1,
+        or with dense output, the orbits are evolved in this process.
+        With store_path the still valid stored solutions are loaded first
+        and the store is rewritten when some orbit had to be integrated.
+        """
+        if store_path is not None:
+            self.load(store_path)
+        pending = [self.orbit_set[i] for i in self.orbit_set.pending()]
+        if not pending:
+            return
+        if n_workers == 1 or self.dense_output:
+            for orb in pending:
+                orb.evolve()
+        else:
+            parallel.evolve_orbits(pending, n_workers=n_workers, chunksize=chunksize)
+        if store_path is not None:
+            self.save(store_path)
+
+    def save(self, path, n_workers=None):
+        """Evolve the pending orbits and write all the solutions to path."""
+        self.evolve_all(n_workers=n_workers)
+        store.save(path, self._Orbits)
+
+    def load(self, path, mmap=True):
+        """Restore the orbits whose stored solution at path is still valid.
+
+        Solutions are memory-mapped views unless mmap=False. Returns the
+        number of orbits restored, see store.restore.
+        """
+        return store.restore(path, self._Orbits, mmap=mmap)
+
+    def poincare_section(self, section, n_crossings=100, t_max=np.inf, **options):
+        """Crossings of a section.Section for all the orbits at once.
+
+        The `orbit` field of the result indexes self._Orbits.
+        """
+        return poincare_section(self.model, self.orbit_set.inits, section,
+                                model_pars=self.model_pars,
+                                n_crossings=n_crossings, t_max=t_max, **options)
+
+    def observable(self, name):
+        """Values of the model observable name along every orbit (a list).
+
+        Orbits solved by evolve_ensemble() share one evaluation over their
+        slab (their values are views of it, truncated like the solution);
+        the others use Orbit.observable(). Both are memoized.
+        """
+        values = []
+        for i in range(len(self.orbit_set)):
+            row = self.orbit_set.observable(i, name)
+            if row is None:
+                row = self._Orbits[i].observable(name)
+            elif self.constraints:
+                row = row[:valid_length(self.orbit_set.solution(i), self.constraints)]
+            values.append(row)
+        return values
+
+    def cache_info(self):
+        """Return the solution cache hits/misses summed over all the orbits
+        (an orbit integrated in an ensemble slab is one miss)."""
+        views = [orb for i, orb in self.orbit_set.views()]   # the others never ran
+        hits = sum(orb.cache_hits for orb in views)
+        misses = self.orbit_set.slab_misses + sum(orb.cache_misses for orb in views)
+        return CacheInfo(hits=hits, misses=misses, orbits=len(self.orbit_set))
+
+    def profile_report(self, log=True):
+        """profiling.Report of what was recorded while profiling was enabled.
+
+        Counters get the solution cache totals of these orbits (cache.hits,
+        cache.misses) and the cached vector fields; orbits are limited to
+        the labels of this system. With log the report is emitted through
+        the 'pyncare.profiling' logger.
+        """
+        rep = profiling.report()
+        info = self.cache_info()
+        counters = dict(rep.counters)
+        counters.update({'cache.hits': info.hits, 'cache.misses': info.misses,
+                         'vector_field.cached': len(self._field_cache)})
+        labels = set(str(label) for label in self.orbit_set.labels)
+        orbits = dict((label, stats) for label, stats in rep.orbits.items()
+                      if label in labels)
+        rep = profiling.Report(stages=rep.stages, counters=counters, orbits=orbits)
+        if log:
+            profiling.log_report(rep)
+        return rep
+
+    def clear_cache(self):
+        """Invalidate the solutions of all the orbits and the vector fields."""
+        self._field_cache.clear()
+        self.orbit_set.clear_slabs()
+        for i, orb in self.orbit_set.views():
+            orb.invalidate()
+
+    @profiling.timed('plot.orbits')
     def plot_orbits(self, ax, vars_to_plot, colors=None, add_flow=True,
                     add_legend=True, arrow_kws=None, **kwargs):
         if arrow_kws is None:
@@ -149,7 +438,7 @@ class BaseDynSys(object):
             if add_flow:
                 arrow_kws['color'] = color
                 orb.plot_flow_over_orbit(ax=ax, vars_to_plot=vars_to_plot,
-                                         flow_index=self.orbits[i]['arrow_pos'],
+                                         flow_index=self.orbit_set.arrows(i),
                                          arrow_kws=arrow_kws)
         if add_legend:
             ax.legend(loc='best')
@@ -158,12 +447,113 @@ class BaseDynSys(object):
         if len(vars_to_plot) == 3:
             ax.set_zlabel(self.var_names[vars_to_plot[2]])
 
+    def _stored_states(self, i, t):
+        """(len(t), Ndim) states of orbit i on its grid t when it is already
+        solved (ensemble slab or Orbit view), NaN past the rows it reached;
+        None when it must be integrated."""
+        view = self.orbit_set._views.get(i)
+        if view is None or not (view.is_solved and view._cache_key == view._solution_key(t)):
+            return self.orbit_set.solution(i)   # any solver will do for a density
+        states = np.asarray(view.grid_solution())
+        if len(states) < len(t):
+            states = np.concatenate([states, np.full((len(t) - len(states), self.Ndim),
+                                                     np.nan)])
+        return states
+
+    def _chunk_states(self, chunk, t, method, out):
+        """(len(chunk), len(t), Ndim) states of the orbits chunk: the stored
+        solutions, the others integrated together with ensemble.integrate
+        (in out, a buffer reused between chunks). Returns (states, out)."""
+        states = [self._stored_states(i, t) for i in chunk]
+        missing = [k for k, sol in enumerate(states) if sol is None]
+        if not missing:
+            return np.stack(states), out
+        shape = (len(chunk), len(t), self.Ndim)
+        if out is None or out.shape != shape:
+            out = np.empty(shape)
+        solved = ensemble.integrate(self.model, self.orbit_set.inits[chunk[missing]], t,
+                                    model_pars=self.model_pars, method=method,
+                                    constraints=self.constraints, out=out[:len(missing)])
+        slab = np.empty(shape)
+        slab[missing] = solved
+        for k, sol in enumerate(states):
+            if sol is not None:
+                slab[k] = sol
+        return slab, out
+
+    @profiling.timed('plot.density')
+    def plot_density(self, ax, vars_to_plot=None, bins=512, extent=None, mode='lines',
+                     chunk_size=1000, method='rk45', section=None, n_crossings=100,
+                     log=True, cmap='viridis', **kwargs):
+        """Density image of all the orbits over two variables.
+
+        The orbits are taken chunk_size at a time: the ones already solved
+        (evolve_ensemble() slabs or evolved orbits) are reused, the others
+        are integrated together with ensemble.integrate(method) in a buffer
+        shared by all the chunks. Each chunk is added to a density.Density
+        of bins over extent as 'lines' (trajectory length per pixel) or
+        'points' (states per pixel). With a section.Section the crossings
+        of the orbits are counted instead. kwargs go to imshow. Returns the
+        Density.
+
+        Without extent the bounds of the data are used: with more than one
+        chunk this needs every orbit solved beforehand (a first pass over
+        the stored solutions), otherwise give extent.
+        """
+        if vars_to_plot is None:
+            vars_to_plot = self.names[:2]
+        if mode not in ('lines', 'points'):
+            raise ValueError("mode must be 'lines' or 'points', not {!r}".format(mode))
+        ix, iy = [self.names.index(key) for key in vars_to_plot]
+        self.orbit_set.inits    # write back the edits of the views (drops stale slabs)
+        chunks = [(index[start:start + chunk_size], t)
+                  for index, t in self.orbit_set.groups()
+                  for start in range(0, len(index), chunk_size)]
+        if not chunks:
+            raise ValueError("plot_density needs at least one orbit")
+        if extent is None and len(chunks) > 1:
+            stored = [self._stored_states(i, t) for chunk, t in chunks for i in chunk]
+            if section is not None or any(sol is None for sol in stored):
+                raise ValueError("plot_density needs extent when the orbits span several "
+                                 "chunks and are not all solved (evolve_ensemble)")
+            lo = np.nanmin([np.nanmin(sol[:, [ix, iy]], axis=0) for sol in stored], axis=0)
+            hi = np.nanmax([np.nanmax(sol[:, [ix, iy]], axis=0) for sol in stored], axis=0)
+            extent = bounds([lo[0], hi[0]], [lo[1], hi[1]])
+        density = None
+        out = None
+        for chunk, t in chunks:
+            if section is not None:
+                crossings = sections.poincare_section(
+                    self.model, self.orbit_set.inits[chunk], section,
+                    model_pars=self.model_pars, n_crossings=n_crossings,
+                    t_max=t[-1])
+                x, y = crossings.points[:, ix], crossings.points[:, iy]
+            else:
+                slab, out = self._chunk_states(chunk, t, method, out)
+                x, y = slab[:, :, ix], slab[:, :, iy]
+            if density is None:
+                density = Density(extent if extent is not None else bounds(x, y), bins)
+            if mode == 'lines' and section is None:
+                density.add_lines(x, y)
+            else:
+                density.add_points(x, y)
+        density.show(ax, log=log, cmap=cmap, **kwargs)
+        ax.set_xlabel(self.var_names[vars_to_plot[0]])
+        ax.set_ylabel(self.var_names[vars_to_plot[1]])
+        return density
+
+    @profiling.timed('plot.triangle')
     def triangle(self, fig=None, vars_to_plot=None, colors=None, add_flow=False,
-                 add_legend=False, arrow_kws=None, **kwargs):
+                 add_legend=False, arrow_kws=None, n_workers=None, **kwargs):
+        """Plot every pair of vars_to_plot in the lower triangle of a grid.
+
+        The orbits are integrated once (if not solved yet); kwargs go to
+        the LineCollection of each panel. n_workers > 1 rasterizes the
+        panels in parallel, only for non-interactive figures (see
+        save_triangle). Returns the figure.
+        """
         if vars_to_plot is None:
-            vars_to_plot = []
-            for key, value in self.orbits[0]['vars'].items():
-                vars_to_plot.append(key)
+            vars_to_plot = list(self.names)
         if len(vars_to_plot) == 2:
             warnings.warn('Triangle plots are useful for more than two dimensions')
             return
@@ -171,18 +561,12 @@ class BaseDynSys(object):
         if _DEBUG:
             print(vars_to_plot)
 
-        # Some magic numbers for pretty axis layout.
         M = len(vars_to_plot) - 1
-        factor = 2.0           # size of one side of one panel
-        lbdim = 0.5 * factor   # size of left/bottom margin
-        trdim = 0.2 * factor   # size of top/right margin
-        wspace = 0.0         # w/hspace size
-        hspace = 0.0         # w/hspace size
-        plotdim = factor * M + factor * (M - 1.) * wspace
-        dim = lbdim + plotdim + trdim
+        dim, lb, tr, wspace, hspace = _triangle_layout(M)
 
         # Create a new figure if one wasn't provided.
         if fig is None:
+            import matplotlib.pyplot as plt     # matplotlib loads on first plot
             fig, axes = plt.subplots(M, M, figsize=(dim, dim), sharex=True, sharey=True)
         else:
             try:
@@ -192,33 +576,132 @@ class BaseDynSys(object):
                                  "dimensions M={1}".format(len(fig.axes), M))
 
         # Format the figure.
-        lb = lbdim / dim
-        tr = (lbdim + plotdim) / dim
         fig.subplots_adjust(left=lb, bottom=lb, right=tr, top=tr,
                             wspace=wspace, hspace=hspace)
 
-        for i in xrange(M):
-            for j in xrange(M):
-                varx = vars_to_plot[j]
-                vary = vars_to_plot[M-i]
-                subplotx = M - 1 - i
-                subploty = j
-                ax = axes[subplotx, subploty]
-                if _DEBUG:
-                    print(" -----------------------------")
-                    print('(i, j) = ({},{})'.format(i, j))
-                    print('varx = {}'.format(varx))
-                    print('vary = {}'.format(vary))
-                    print('subplotx = {}'.format(subplotx))
-                    print('subploty = {}'.format(subploty))
-                if subplotx >= subploty:
-                    self.plot_orbits(ax=ax, vars_to_plot=[varx, vary],
-                                     add_flow=add_flow, add_legend=add_legend, arrow_kws=arrow_kws, **kwargs)
-                    if subploty != 0:
-                        ax.set_ylabel('')
-                    ax.tick_params(direction='in', pad=5)
-                else:
+        self._triangle_panels(axes, vars_to_plot, colors=colors, add_flow=add_flow,
+                              add_legend=add_legend, arrow_kws=arrow_kws,
+                              n_workers=n_workers, **kwargs)
+        return fig
+
+    def _triangle_panels(self, axes, vars_to_plot, colors=None, add_flow=False,
+                         add_legend=False, arrow_kws=None, n_workers=None, **kwargs):
+        """Solve the pending orbits once and draw the lower triangle panels.
+
+        With the built-in integrators ('rk4', 'rk45') and its options,
+        orbits sharing one time grid are solved in a single ensemble batch;
+        otherwise (mixed grids, dense output or another integrator) with
+        evolve_all, orbit by orbit.
+        Each panel holds one LineCollection for all the orbits (and one
+        quiver for the arrows). With n_workers the panels are rasterized
+        in a pool of processes, see triangle.render_panels.
+        """
+        with profiling.stage('triangle.evolve'):
+            if (self.integrator in ('rk4', 'rk45') and not self.dense_output
+                    and len(self.orbit_set.groups()) == 1):
+                self.evolve_ensemble(method=self.integrator, pending=True,
+                                     **(self.integrator_options or {}))
+            else:
+                self.evolve_all(n_workers=1)
+        if colors is None:
+            colors = self.colors
+        colorcycler = cycle(colors)
+        line_colors = [next(colorcycler) for _ in range(len(self._Orbits))]
+        if 'color' in kwargs:
+            line_colors = [kwargs.pop('color')] * len(self._Orbits)
+        data = tri.stack([orb.grid_solution() for orb in self._Orbits])
+
+        arrows = None
+        if add_flow:
+            rows = [orb._flow_rows(self.orbit_set.arrows(i))
+                    for i, orb in enumerate(self._Orbits)]
+            points = np.concatenate([orb.grid_solution()[r]
+                                     for orb, r in zip(self._Orbits, rows)])
+            arrow_colors = [c for c, r in zip(line_colors, rows) for _ in r]
+            if len(points):
+                vels = np.asarray(self.evaluate(points.T))      # one model call
+                arrows = (points, vels, arrow_colors)
+
+        panel_axes, tasks = [], []
+        index = dict((name, i) for i, name in enumerate(self.names))
+        for row, col, varx, vary in tri.layout(vars_to_plot):
+            ix, iy = index[varx], index[vary]
+            panel_arrows = None
+            if arrows is not None:
+                points, vels, arrow_colors = arrows
+                panel_arrows = (points[:, ix], points[:, iy], vels[ix], vels[iy], arrow_colors)
+            panel_axes.append(axes[row, col])
+            tasks.append((tri.segments(data, ix, iy), line_colors, panel_arrows,
+                          arrow_kws, kwargs))
+
+        # the axes are shared: the limits cover all the plotted variables
+        xlim = tri.limits(data, sorted(set(index[v] for v in vars_to_plot[:-1])))
+        ylim = tri.limits(data, sorted(set(index[v] for v in vars_to_plot[1:])))
+        if n_workers is not None and n_workers > 1:
+            panel_axes[0].set_xlim(xlim)
+            panel_axes[0].set_ylim(ylim)
+            with profiling.stage('triangle.render_parallel'):
+                tri.render_panels(panel_axes, tasks, n_workers=n_workers)
+        else:
+            with profiling.stage('triangle.draw'):
+                for ax, task in zip(panel_axes, tasks):
+                    tri.draw_panel(ax, *task[:4], **task[4])
+            panel_axes[0].set_xlim(xlim)
+            panel_axes[0].set_ylim(ylim)
+
+        M = len(vars_to_plot) - 1
+        for row in range(M):
+            for col in range(M):
+                ax = axes[row, col]
+                if row < col:
                     ax.set_axis_off()
+                    continue
+                if add_legend:
+                    from matplotlib.lines import Line2D
+                    handles = [Line2D([], [], color=c, label=orb.label)
+                               for c, orb in zip(line_colors, self._Orbits)]
+                    ax.legend(handles=handles, loc='best')
+                if row == M - 1:
+                    ax.set_xlabel(self.var_names[vars_to_plot[col]])
+                if col == 0:
+                    ax.set_ylabel(self.var_names[vars_to_plot[M - row]])
+                ax.tick_params(direction='in', pad=5)
+
+    @profiling.timed('plot.save_triangle')
+    def save_triangle(self, path, vars_to_plot=None, n_workers=None, dpi=100, **kwargs):
+        """Write the triangle plot to path without pyplot (headless).
+
+        The panels are rasterized by n_workers processes (all the CPUs by
+        default); n_workers=1 draws them as vector artists. kwargs are the
+        options of triangle().
+        """
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        if vars_to_plot is None:
+            vars_to_plot = list(self.names)
+        M = len(vars_to_plot) - 1
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        fig = Figure(figsize=(_triangle_layout(M)[0],) * 2, dpi=dpi)
+        FigureCanvasAgg(fig)
+        fig.subplots(M, M, sharex=True, sharey=True)
+        self.triangle(fig=fig, vars_to_plot=vars_to_plot, n_workers=n_workers, **kwargs)
+        with profiling.stage('savefig'):
+            fig.savefig(path, dpi=dpi)
+        return fig
+
+
+def _triangle_layout(M):
+    """Figure side and margins of an M x M triangle plot."""
+    # Some magic numbers for pretty axis layout.
+    factor = 2.0           # size of one side of one panel
+    lbdim = 0.5 * factor   # size of left/bottom margin
+    trdim = 0.2 * factor   # size of top/right margin
+    wspace = 0.0         # w/hspace size
+    hspace = 0.0         # w/hspace size
+    plotdim = factor * M + factor * (M - 1.) * wspace
+    dim = lbdim + plotdim + trdim
+    return dim, lbdim / dim, (lbdim + plotdim) / dim, wspace, hspace
 
 
 def test_model(init, t=None, model_pars=[]):
@@ -234,6 +717,7 @@ def test_model(init, t=None, model_pars=[]):
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
     from collections import OrderedDict
 
     fig = plt.figure()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        ensemble.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: Batched integrators for ensembles of orbits. All the initial
+             conditions are stacked in a (N_orbits, Ndim) state array and
+             advanced together, the model is evaluated once per stage over
+             the whole batch. Scalar-only models are looped over the batch
+             (see protocol.py).
+"""
+import collections
+import numpy as np
+import warnings
+import profiling
+from buffers import GrowableArray
+from constraints import inside_all
+from protocol import batch_model
+
+# Dormand-Prince 5(4) tableau
+_DP_C = np.array([0.0, 1.0/5.0, 3.0/10.0, 4.0/5.0, 8.0/9.0, 1.0, 1.0])
+_DP_A = [[],
+         [1.0/5.0],
+         [3.0/40.0, 9.0/40.0],
+         [44.0/45.0, -56.0/15.0, 32.0/9.0],
+         [19372.0/6561.0, -25360.0/2187.0, 64448.0/6561.0, -212.0/729.0],
+         [9017.0/3168.0, -355.0/33.0, 46732.0/5247.0, 49.0/176.0, -5103.0/18656.0],
+         [35.0/384.0, 0.0, 500.0/1113.0, 125.0/192.0, -2187.0/6784.0, 11.0/84.0]]
+_DP_B = np.array([35.0/384.0, 0.0, 500.0/1113.0, 125.0/192.0,
+                  -2187.0/6784.0, 11.0/84.0, 0.0])
+_DP_E = np.array([71.0/57600.0, 0.0, -71.0/16695.0, 71.0/1920.0,
+                  -17253.0/339200.0, 22.0/525.0, -1.0/40.0])  # B - B_hat
+
+
+def batch_rhs(model, model_pars):
+    """Return f(t, y) evaluating the model over a (N, Ndim) state array."""
+    f = batch_model(model, model_pars)
+
+    def rhs(t, y):
+        return f(y.T, t).T
+    return rhs
+
+
+def _stack(inits):
+    y0 = np.array(inits, dtype=float)
+    if y0.ndim == 1:
+        y0 = y0[np.newaxis, :]
+    return y0
+
+
+def _allocate(y0, t, out):
+    shape = (y0.shape[0], len(t), y0.shape[1])
+    if out is None:
+        out = np.empty(shape)
+    elif out.shape != shape:
+        raise ValueError("out has shape {}, expected {}".format(out.shape, shape))
+    out[:, 0] = y0
+    return out
+
+
+def _retire(out, i, y, active, constraints):
+    """Stop the orbits whose state at row i left the constraints.
+
+    Their rows from i on are set to NaN. Returns the surviving states and
+    the indexes of the orbits still active.
+    """
+    out[active, i] = y
+    if constraints is None:
+        return y, active
+    keep = inside_all(constraints, y.T)
+    if keep.all():
+        return y, active
+    out[active[~keep], i:] = np.nan
+    return y[keep], active[keep]
+
+
+def rk4(model, inits, t, model_pars=[], substeps=1, constraints=None, out=None):
+    """Classic fixed step Runge-Kutta over the time grid t.
+
+    Each interval of t is split in `substeps` steps. Orbits leaving the
+    constraints stop being integrated, their remaining rows are NaN.
+    Returns an array of shape (N_orbits, len(t), Ndim).
+    """
+    y0 = _stack(inits)
+    out = _allocate(y0, t, out)
+    f = batch_rhs(model, model_pars)
+    y, active = _retire(out, 0, y0.copy(), np.arange(len(y0)), constraints)
+    for k in range(len(t) - 1):
+        if active.size == 0:
+            break
+        h = (t[k + 1] - t[k]) / float(substeps)
+        tk = t[k]
+        for s in range(substeps):
+            k1 = f(tk, y)
+            k2 = f(tk + 0.5 * h, y + 0.5 * h * k1)
+            k3 = f(tk + 0.5 * h, y + 0.5 * h * k2)
+            k4 = f(tk + h, y + h * k3)
+            y = y + h / 6.0 * (k1 + 2.0 * k2 + 2.0 * k3 + k4)
+            tk = tk + h
+        y, active = _retire(out, k + 1, y, active, constraints)
+    return out
+
+
+def error_norm(err, y, y_new, atol, rtol):
+    """Scaled RMS error of the worst orbit, lost (non finite) orbits ignored.
+
+    Without constraints to stop them the integrators warn about lost
+    orbits, see _warn_lost.
+    """
+    scale = atol + rtol * np.maximum(np.abs(y), np.abs(y_new))
+    per_orbit = np.sqrt(np.mean((err / scale)**2.0, axis=1))
+    per_orbit = per_orbit[np.isfinite(per_orbit)]  # orbits already lost
+    if per_orbit.size == 0:
+        return 0.0
+    return per_orbit.max()
+
+
+def _warn_lost(y, t, name='rk45'):
+    """Warn if some orbit of y is no longer finite, returns True if so."""
+    lost = ~np.all(np.isfinite(y), axis=1)
+    if not lost.any():
+        return False
+    warnings.warn("{}: {} orbit(s) not finite at t={}, left out of the step control "
+                  "(give constraints to stop them)".format(name, int(lost.sum()), t),
+                  RuntimeWarning)
+    return True
+
+
+def dp45_step(f, t, y, k1, hs):
+    """One Dormand-Prince 5(4) step of size hs from (t, y) with k1 = f(t, y).
+
+    Returns the new state, the stages (k[6] is f at the new state) and the
+    embedded error estimate.
+    """
+    k = np.empty((7,) + y.shape)
+    k[0] = k1
+    for s in range(1, 7):
+        dy = np.tensordot(_DP_A[s], k[:s], axes=1)
+        k[s] = f(t + _DP_C[s] * hs, y + hs * dy)
+    y_new = y + hs * np.tensordot(_DP_B, k, axes=1)
+    return y_new, k, hs * np.tensordot(_DP_E, k, axes=1)
+
+
+def step_factor(err, accepted):
+    """Step size change factor of the standard controller."""
+    if err == 0.0:
+        return 10.0
+    if accepted:
+        return min(10.0, 0.9 * err**-0.2)
+    return max(0.2, 0.9 * err**-0.2)
+
+
+def rk45(model, inits, t, model_pars=[], rtol=1e-6, atol=1e-9,
+         first_step=None, max_step=np.inf, constraints=None, out=None, info=None):
+    """Adaptive Dormand-Prince 5(4) with a step size shared by the batch.
+
+    The step is controlled by the worst orbit of the batch and is clipped
+    to land exactly on every point of t. Orbits found outside the
+    constraints at a point of t stop being integrated, their remaining rows
+    are NaN. Returns an array of shape (N_orbits, len(t), Ndim); the next
+    step size is stored in info['last_step'] when a dict is given, with
+    the number of accepted and rejected steps (n_steps, n_rejected).
+    """
+    y0 = _stack(inits)
+    out = _allocate(y0, t, out)
+    f = batch_rhs(model, model_pars)
+    y, active = _retire(out, 0, y0.copy(), np.arange(len(y0)), constraints)
+    if len(t) < 2 or active.size == 0:
+        return out
+    direction = np.sign(t[-1] - t[0])
+    tk = t[0]
+    k1 = f(tk, y)
+    if first_step is None:
+        h = min(abs(t[1] - t[0]), max_step)
+    else:
+        h = first_step
+    h_min = 1e-14 * max(abs(t[-1] - t[0]), 1.0)
+    n_steps = n_rejected = 0
+    warned = bool(constraints)     # constraints retire the lost orbits
+    for i in range(1, len(t)):
+        while direction * (t[i] - tk) > 0.0:
+            h = min(h, max_step, abs(t[i] - tk))
+            hs = direction * h
+            y_new, k, err = dp45_step(f, tk, y, k1, hs)
+            err = error_norm(err, y, y_new, atol, rtol)
+            accepted = err <= 1.0
+            if accepted or h <= h_min:
+                if not accepted:
+                    warnings.warn("rk45: step size underflow at t={}".format(tk))
+                tk = t[i] if h == abs(t[i] - tk) else tk + hs
+                y = y_new
+                k1 = k[6]  # FSAL
+                n_steps += 1
+                if not warned:
+                    warned = _warn_lost(y, tk)
+            else:
+                n_rejected += 1
+            h = max(h * step_factor(err, accepted), h_min)
+        n_active = active.size
+        y, active = _retire(out, i, y, active, constraints)
+        if active.size == 0:
+            break
+        if active.size < n_active:
+            k1 = f(tk, y)
+    if info is not None:
+        info['last_step'] = h
+        info['n_steps'] = n_steps
+        info['n_rejected'] = n_rejected
+    return out
+
+
+def rk45_steps(model, inits, t_span, model_pars=[], rtol=1e-6, atol=1e-9,
+               first_step=None, max_step=np.inf):
+    """Adaptive Dormand-Prince 5(4) keeping the solver's own steps.
+
+    Returns the step times, the states (N_steps, N_orbits, Ndim) and the
+    derivatives at those states, ready for a HermiteInterpolant.
+    """
+    y = _stack(inits)
+    f = batch_rhs(model, model_pars)
+    t0, t1 = float(t_span[0]), float(t_span[-1])
+    direction = np.sign(t1 - t0)
+    tk = t0
+    k1 = f(tk, y)
+    ts = GrowableArray(())
+    ys = GrowableArray(y.shape)
+    fs = GrowableArray(y.shape)
+    ts.append(tk)
+    ys.append(y)
+    fs.append(k1)
+    h = min(abs(t1 - t0) / 100.0 if first_step is None else first_step, max_step)
+    h_min = 1e-14 * max(abs(t1 - t0), 1.0)
+    warned = False
+    while direction * (t1 - tk) > 0.0:
+        h = min(h, max_step, abs(t1 - tk))
+        hs = direction * h
+        y_new, k, err = dp45_step(f, tk, y, k1, hs)
+        err = error_norm(err, y, y_new, atol, rtol)
+        accepted = err <= 1.0
+        if accepted or h <= h_min:
+            if not accepted:
+                warnings.warn("rk45: step size underflow at t={}".format(tk))
+            tk = t1 if h == abs(t1 - tk) else tk + hs
+            y = y_new
+            k1 = k[6]
+            if not warned:
+                warned = _warn_lost(y, tk)
+            ts.append(tk)
+            ys.append(y)
+            fs.append(k1)
+        h = max(h * step_factor(err, accepted), h_min)
+    return ts.trim(), ys.trim(), fs.trim()
+
+
+class HermiteInterpolant(object):
+    """Piecewise cubic Hermite interpolant through states and derivatives.
+
+    ts must be monotonic (increasing or decreasing); ys and fs have shape
+    (len(ts),) + state_shape. Calling it with times of shape S returns an
+    array of shape S + state_shape.
+    """
+
+    def __init__(self, ts, ys, fs):
+        self.ts = np.asarray(ts, dtype=float)
+        self.ys = np.asarray(ys, dtype=float)
+        self.fs = np.asarray(fs, dtype=float)
+        self._sign = -1.0 if self.ts[-1] < self.ts[0] else 1.0
+
+    def __call__(self, t):
+        t = np.asarray(t, dtype=float)
+        ts = self._sign * self.ts
+        i = np.searchsorted(ts, self._sign * t, side='right') - 1
+        i = np.clip(i, 0, len(ts) - 2)
+        h = self.ts[i + 1] - self.ts[i]
+        th = (t - self.ts[i]) / h
+        th = th.reshape(th.shape + (1,) * (self.ys.ndim - 1))
+        h = h.reshape(th.shape)
+        th2 = th * th
+        th3 = th2 * th
+        return ((2.0 * th3 - 3.0 * th2 + 1.0) * self.ys[i] +
+                (th3 - 2.0 * th2 + th) * h * self.fs[i] +
+                (-2.0 * th3 + 3.0 * th2) * self.ys[i + 1] +
+                (th3 - th2) * h * self.fs[i + 1])
+
+
+_methods = {'rk4': rk4, 'rk45': rk45}
+
+
+def integrate(model, inits, t, model_pars=[], method='rk45', out=None, **options):
+    """Integrate all the initial conditions together with the given method.
+
+    With profiling enabled, the model calls and evaluated states (and the
+    steps of rk45) are counted; they are also added to options['info']
+    when a dict is given.
+    """
+    if method not in _methods:
+        raise ValueError("method must be one of {}".format(sorted(_methods)))
+    t = np.asarray(t, dtype=float)
+    if not profiling.ENABLED:
+        return _methods[method](model, inits, t, model_pars=model_pars, out=out, **options)
+    tally = collections.Counter()
+    info = options.get('info')
+    if method == 'rk45' and info is None:
+        info = options['info'] = {}
+    with profiling.stage('ensemble.' + method):
+        out = _methods[method](profiling.counted(model, tally), inits, t,
+                               model_pars=model_pars, out=out, **options)
+    for key in ('n_steps', 'n_rejected'):
+        if info is not None and key in info:
+            tally[key] = info[key]
+    for key, n in tally.items():
+        profiling.count('ensemble.' + key, n)
+    if info is not None:
+        info['nfev'] = tally['rhs_states']
+    return out
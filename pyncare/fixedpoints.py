@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        fixedpoints.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: Critical points of a model and their linear stability. Many
+             seeds are refined together by a damped Newton iteration, the
+             roots are deduplicated with a KD-tree and classified from the
+             eigenvalues of the Jacobian.
+
+             A Jacobian function follows the model convention,
+             jac(init, t=None, model_pars=[]) -> J with J[i][j] the
+             derivative of the i-th velocity respect to the j-th variable,
+             vectorized over a trailing batch axis. Models carrying a
+             `jacobian` attribute use it, otherwise finite differences.
+"""
+import collections
+import numpy as np
+from scipy.spatial import cKDTree
+from constraints import inside_all
+from protocol import batch_model
+
+FixedPoint = collections.namedtuple('FixedPoint', ['point', 'eigenvalues', 'kind'])
+
+
+def jacobian_fd(f, states, t=None, eps=1e-7):
+    """Central finite differences of a batch model f at states (Ndim, N).
+
+    All the 2*Ndim perturbations are evaluated in one call. Returns an
+    array of shape (N, Ndim, Ndim).
+    """
+    states = np.asarray(states, dtype=float)
+    Ndim, N = states.shape
+    h = eps * np.maximum(1.0, np.abs(states))            # (Ndim, N)
+    shifted = np.repeat(states[:, np.newaxis, :], 2 * Ndim, axis=1)
+    for j in range(Ndim):
+        shifted[j, j] += h[j]
+        shifted[j, Ndim + j] -= h[j]
+    vels = f(shifted, t)                                  # (Ndim, 2 Ndim, N)
+    J = (vels[:, :Ndim] - vels[:, Ndim:]) / (2.0 * h[np.newaxis])
+    return np.transpose(J, (2, 0, 1))
+
+
+def batch_jacobian(model, model_pars=[], jacobian=None, eps=1e-7):
+    """Return J(states, t=None) -> (N, Ndim, Ndim) for states (Ndim, N)."""
+    if jacobian is None:
+        jacobian = getattr(model, 'jacobian', None)
+    if jacobian is not None:
+        def J(states, t=None):
+            states = np.asarray(states, dtype=float)
+            jac = jacobian(states, t, model_pars)
+            Ndim, N = states.shape
+            out = np.empty((Ndim, Ndim, N))
+            for i in range(Ndim):
+                for j in range(Ndim):
+                    out[i, j] = jac[i][j]     # broadcast constant entries
+            return np.transpose(out, (2, 0, 1))
+        return J
+    f = batch_model(model, model_pars)
+
+    def J(states, t=None):
+        return jacobian_fd(f, states, t=t, eps=eps)
+    return J
+
+
+def classify(eigenvalues, tol=1e-8):
+    """Name the linear stability of a critical point from its eigenvalues."""
+    re = np.real(eigenvalues)
+    im = np.imag(eigenvalues)
+    rotating = np.any(np.abs(im) > tol)
+    if np.any(np.abs(re) <= tol):
+        if np.all(np.abs(re) <= tol) and rotating:
+            return 'centre'
+        return 'non-hyperbolic'
+    if np.all(re < 0.0):
+        return 'stable focus' if rotating else 'stable node'
+    if np.all(re > 0.0):
+        return 'unstable focus' if rotating else 'unstable node'
+    return 'saddle'
+
+
+def _solve(J, F):
+    """Newton steps J dx = -F for a stack of systems, singular ones by pinv."""
+    try:
+        return np.linalg.solve(J, -F[..., np.newaxis])[..., 0]
+    except np.linalg.LinAlgError:
+        return -np.einsum('nij,nj->ni', np.linalg.pinv(J), F)
+
+
+def newton(model, seeds, model_pars=[], jacobian=None, tol=1e-10, xtol=1e-10,
+           max_iter=50, max_halvings=8):
+    """Damped Newton iteration on all the seeds (N, Ndim) at once.
+
+    A seed converges when both the residual is below tol and the last
+    step below xtol, so slow, flat regions are not taken as roots.
+    Returns the final points and a mask of the converged ones.
+    """
+    f = batch_model(model, model_pars)
+    J = batch_jacobian(model, model_pars, jacobian=jacobian)
+    x = np.array(seeds, dtype=float)
+    converged = np.zeros(len(x), dtype=bool)
+    active = np.arange(len(x))
+    step = np.full(len(x), np.inf)
+    with np.errstate(all='ignore'):
+        F = f(x.T).T
+        for it in range(max_iter + 1):
+            res = np.sqrt(np.sum(F**2.0, axis=1))
+            done = (res < tol) & (step < xtol)
+            converged[active[done]] = True
+            keep = ~done & np.isfinite(res)
+            active, F, res, step = active[keep], F[keep], res[keep], step[keep]
+            if active.size == 0 or it == max_iter:
+                break
+            dx = _solve(J(x[active].T), F)
+            alpha = np.ones(len(active))
+            todo = np.ones(len(active), dtype=bool)
+            x_new = x[active] + dx
+            F_new = f(x_new.T).T
+            for k in range(max_halvings):    # backtrack where no progress
+                worse = ~(np.sqrt(np.sum(F_new**2.0, axis=1)) < res) & todo
+                if not worse.any():
+                    break
+                alpha[worse] *= 0.5
+                x_new[worse] = x[active[worse]] + alpha[worse, np.newaxis] * dx[worse]
+                F_new[worse] = f(x_new[worse].T).T
+            step = np.sqrt(np.sum((x_new - x[active])**2.0, axis=1))
+            x[active] = x_new
+            F = F_new
+    return x, converged
+
+
+def deduplicate(points, tol=1e-6):
+    """Keep one point of each cluster of points closer than tol."""
+    if len(points) == 0:
+        return points
+    tree = cKDTree(points)
+    taken = np.zeros(len(points), dtype=bool)
+    keep = []
+    for i, neighbours in enumerate(tree.query_ball_point(points, r=tol)):
+        if not taken[i]:
+            keep.append(i)
+            taken[neighbours] = True
+    return points[keep]
+
+
+def find_fixed_points(model, bounds, model_pars=[], n_seeds=200, jacobian=None,
+                      constraints=None, tol=1e-10, max_iter=50, dedup_tol=1e-6,
+                      seed=0):
+    """Critical points of model inside bounds [(min, max), ...] per variable.
+
+    n_seeds random start points are refined by newton(); the converged
+    roots inside bounds and constraints are deduplicated and classified.
+    Returns a list of FixedPoint(point, eigenvalues, kind).
+    """
+    bounds = np.asarray(bounds, dtype=float)
+    lo, hi = bounds[:, 0], bounds[:, 1]
+    rng = np.random.RandomState(seed)
+    seeds = lo + (hi - lo) * rng.random_sample((n_seeds, len(lo)))
+    x, converged = newton(model, seeds, model_pars=model_pars, jacobian=jacobian,
+                          tol=tol, max_iter=max_iter)
+    margin = 10.0 * dedup_tol
+    ok = converged & np.all((x >= lo - margin) & (x <= hi + margin), axis=1)
+    if constraints:
+        ok &= inside_all(constraints, x.T)
+    roots = deduplicate(x[ok], tol=dedup_tol)
+    if len(roots) == 0:
+        return []
+    J = batch_jacobian(model, model_pars, jacobian=jacobian)(roots.T)
+    eigenvalues = np.linalg.eigvals(J)
+    return [FixedPoint(point=p, eigenvalues=ev, kind=classify(ev))
+            for p, ev in zip(roots, eigenvalues)]
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        integrators.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: Integrator backends used by Orbit. Available methods:
+
+                 'odeint'                      scipy.integrate.odeint
+                 'RK45', 'RK23', 'DOP853',
+                 'LSODA', 'Radau', 'BDF'       scipy.integrate.solve_ivp
+                 'rk4', 'rk45'                 vectorized RK of ensemble.py
+
+             With dense_output=True the solver takes its own adaptive steps
+             over the span of t and returns an interpolant to query any
+             time lazily (not available for 'odeint' and 'rk4').
+
+             The implicit solvers use the analytic Jacobian of models
+             carrying a `jacobian` attribute (see symbolic.py).
+
+             Leaving the region given by constraints (see constraints.py)
+             is a terminal event: the integration stops and the returned
+             solution is truncated. odeint can not stop on events, LSODA
+             through solve_ivp is used instead when constraints are given
+             (with a RuntimeWarning).
+"""
+import collections
+import numpy as np
+import warnings
+from scipy.integrate import odeint, solve_ivp
+import ensemble
+import profiling
+from constraints import valid_length
+from fixedpoints import jacobian_fd
+from protocol import batch_model
+
+Result = collections.namedtuple('Result', ['t', 'y', 'dense', 'info'])
+
+SOLVE_IVP_METHODS = ('RK45', 'RK23', 'DOP853', 'LSODA', 'Radau', 'BDF')
+_JAC_METHODS = ('LSODA', 'Radau', 'BDF')    # use model.jacobian if present
+METHODS = ('odeint',) + SOLVE_IVP_METHODS + ('rk4', 'rk45')
+
+
+class _SolveIvpDense(object):
+    """Wrap an OdeSolution to return arrays of shape t.shape + (Ndim,)."""
+
+    def __init__(self, sol):
+        self.sol = sol
+
+    def __call__(self, t):
+        t = np.asarray(t, dtype=float)
+        return np.moveaxis(self.sol(t.ravel()), 0, -1).reshape(t.shape + (-1,))
+
+
+def _analytic_jac(model, model_pars):
+    """jac(t, y) from model.jacobian, by finite differences where singular.
+
+    The analytic form may not be finite where the field is, e.g. on the
+    equator of a compactified model (see symbolic.compactify).
+    """
+    f = batch_model(model, model_pars)
+
+    def jac(t, y):
+        with np.errstate(all='ignore'):
+            J = np.array(model.jacobian(y, t, model_pars), dtype=float)
+        if np.all(np.isfinite(J)):
+            return J
+        return jacobian_fd(f, np.asarray(y, dtype=float)[:, np.newaxis], t)[0]
+    return jac
+
+
+def _odeint(model, init, t, model_pars, dense_output, options):
+    if dense_output:
+        raise ValueError("odeint has no dense output, use method='LSODA'")
+    if getattr(model, 'jacobian', None) is not None and 'Dfun' not in options:
+        jac = _analytic_jac(model, model_pars)
+        options = dict(options, Dfun=lambda y, t, model_pars: jac(t, y))
+    options = dict(options, full_output=True)
+    y, out = odeint(model, init, t=t, args=(model_pars,), **options)
+    info = {}
+    if len(t) > 1:
+        info['nfev'] = int(out['nfe'][-1])
+        info['n_steps'] = int(out['nst'][-1])
+    if len(t) > 1 and out['hu'][-1] > 0.0:
+        info['last_step'] = float(out['hu'][-1])
+    return Result(t=t, y=y, dense=None, info=info)
+
+
+def _solve_ivp(model, init, t, model_pars, method, dense_output, constraints, options):
+    def fun(t, y):
+        return np.asarray(model(y, t, model_pars), dtype=float)
+
+    events = None
+    if constraints:
+        events = [c.event() for c in constraints]
+        free_fun = fun
+
+        def fun(t, y):
+            # the free field, so the step crossing the boundary (and the
+            # event located on its interpolant) is the true one; only non
+            # finite values, past a singularity of the model, are masked
+            with np.errstate(invalid='ignore', divide='ignore'):
+                dy = free_fun(t, y)
+            if not np.all(np.isfinite(dy)):
+                return np.where(np.isfinite(dy), dy, 0.0)
+            return dy
+    jacobian = getattr(model, 'jacobian', None)
+    if jacobian is not None and method in _JAC_METHODS and 'jac' not in options:
+        options = dict(options, jac=_analytic_jac(model, model_pars))
+    t_eval = None if dense_output else t
+    sol = solve_ivp(fun, (t[0], t[-1]), init, method=method, t_eval=t_eval,
+                    dense_output=dense_output, events=events, **options)
+    if sol.status == -1:
+        warnings.warn("{}: {}".format(method, sol.message))
+    info = {'nfev': sol.nfev, 'njev': sol.njev, 'nlu': sol.nlu,
+            'terminated': sol.status == 1}
+    if sol.status == 1:
+        info['t_event'] = min(te[0] for te in sol.t_events if len(te))
+    if dense_output and len(sol.t) > 1:
+        info['last_step'] = abs(sol.t[-1] - sol.t[-2])
+    if dense_output:
+        return Result(t=sol.t, y=sol.y.T, dense=_SolveIvpDense(sol.sol), info=info)
+    if sol.status == 1:
+        return Result(t=sol.t, y=sol.y.T, dense=None, info=info)
+    y = np.full((len(t), len(init)), np.nan)  # keep the shape if it failed
+    y[:len(sol.t)] = sol.y.T
+    return Result(t=t, y=y, dense=None, info=info)
+
+
+def _builtin(model, init, t, model_pars, method, dense_output, constraints, options):
+    if not dense_output:
+        info = {}
+        if method == 'rk45':
+            options = dict(options, info=info)
+        y = ensemble.integrate(model, [init], t, model_pars=model_pars,
+                               method=method, constraints=constraints, **options)[0]
+        if constraints:
+            n = valid_length(y, constraints)
+            info['terminated'] = n < len(t)
+            t, y = t[:n], y[:n]
+        return Result(t=t, y=y, dense=None, info=info)
+    if method != 'rk45':
+        raise ValueError("{} has no dense output, use method='rk45'".format(method))
+    if constraints:
+        raise ValueError("rk45 dense output does not support constraints")
+    ts, ys, fs = ensemble.rk45_steps(model, [init], (t[0], t[-1]),
+                                     model_pars=model_pars, **options)
+    dense = ensemble.HermiteInterpolant(ts, ys[:, 0], fs[:, 0])
+    return Result(t=ts, y=ys[:, 0], dense=dense, info={'last_step': ts[-1] - ts[-2]})
+
+
+def first_step_option(method, constraints=None):
+    """Name of the initial step size option of a method (None for rk4)."""
+    if method == 'odeint' and not constraints:
+        return 'h0'
+    if method == 'rk4':
+        return None
+    return 'first_step'
+
+
+def integrate(model, init, t, model_pars=[], method='odeint',
+              dense_output=False, constraints=None, **options):
+    """Integrate one orbit, options are passed to the underlying solver.
+
+    Returns Result(t, y, dense, info): the output times, the states with
+    shape (len(t), Ndim), the interpolant (or None) and solver statistics,
+    with the solver's last step size in info['last_step'] when known.
+    When a constraint stops the orbit, t and y are truncated and
+    info['terminated'] is True.
+    """
+    t = np.asarray(t, dtype=float)
+    init = np.asarray(init, dtype=float)
+    if method == 'odeint' and constraints:
+        warnings.warn("odeint can not stop on constraints, integrating with LSODA",
+                      RuntimeWarning)
+        method = 'LSODA'
+    with profiling.stage('integrate.' + method):
+        return _integrate(model, init, t, model_pars, method, dense_output,
+                          constraints, options)
+
+
+def _integrate(model, init, t, model_pars, method, dense_output, constraints, options):
+    if method == 'odeint':
+        return _odeint(model, init, t, model_pars, dense_output, options)
+    if method in SOLVE_IVP_METHODS:
+        return _solve_ivp(model, init, t, model_pars, method, dense_output,
+                          constraints, options)
+    if method in ('rk4', 'rk45'):
+        return _builtin(model, init, t, model_pars, method, dense_output,
+                        constraints, options)
+    raise ValueError("method must be one of {}".format(METHODS))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        lyapunov.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: Lyapunov spectra of batches of orbits. The states (N, Ndim)
+             and their tangent vectors (N, Ndim, k) are advanced together
+             with RK4 steps of the model and its variational equations
+             dQ/dt = J Q. Every few steps the tangent vectors are
+             re-orthonormalized by QR and the logarithms of the diagonal
+             of R accumulated. The Jacobian is the model's (or a given)
+             analytic one or finite differences, see fixedpoints.py.
+"""
+import collections
+import numpy as np
+from buffers import GrowableArray
+from constraints import inside_all
+from ensemble import batch_rhs, _stack
+from fixedpoints import batch_jacobian
+
+Lyapunov = collections.namedtuple('Lyapunov', ['exponents', 't', 'history'])
+Progress = collections.namedtuple('Progress', ['t', 'exponents', 'change', 'n_active'])
+
+
+def _qr(Q):
+    """QR of a stack of matrices with a non-negative diagonal of R."""
+    Q, R = np.linalg.qr(Q)
+    d = np.diagonal(R, axis1=1, axis2=2)
+    sign = np.where(d < 0.0, -1.0, 1.0)
+    return Q * sign[:, np.newaxis, :], np.abs(d)
+
+
+def lyapunov_spectrum(model, inits, t_max, model_pars=[], n_exponents=None,
+                      dt=1e-2, qr_every=10, t_transient=0.0, jacobian=None,
+                      constraints=None, callback=None, history=False):
+    """Lyapunov spectra of the orbits starting at inits (N, Ndim).
+
+    The first n_exponents (all by default) exponents are estimated by
+    integrating from 0 to t_max with RK4 steps dt, re-orthonormalizing
+    every qr_every steps; the stretching before t_transient is discarded.
+    After every QR past the transient callback(Progress(t, exponents,
+    change, n_active)) is called, change being the largest variation of
+    the estimates since the previous one; returning True stops the run.
+    Orbits leaving the constraints (or not finite) get NaN exponents.
+    Returns Lyapunov(exponents (N, k), t, history), history being the
+    times and estimates (n_qr, N, k) after every QR when asked for.
+    """
+    y = _stack(inits).copy()
+    N, Ndim = y.shape
+    k = Ndim if n_exponents is None else n_exponents
+    f = batch_rhs(model, model_pars)
+    J = batch_jacobian(model, model_pars, jacobian=jacobian)
+
+    def rhs(t, y, Q):
+        return f(t, y), np.matmul(J(y.T, t), Q)
+
+    Q = np.tile(np.eye(Ndim)[:, :k], (N, 1, 1))
+    log_sum = np.zeros((N, k))
+    exponents = np.full((N, k), np.nan)
+    active = np.arange(N)
+    if constraints:
+        keep = inside_all(constraints, y.T)
+        active, y, Q = active[keep], y[keep], Q[keep]
+    if history:
+        t_buf = GrowableArray((), capacity=64)
+        e_buf = GrowableArray((N, k), capacity=64)
+    t = 0.0
+    n_steps = int(np.ceil(t_max / dt))
+    with np.errstate(all='ignore'):
+        for n in range(1, n_steps + 1):
+            if active.size == 0:
+                break
+            h = min(dt, t_max - t)
+            k1y, k1q = rhs(t, y, Q)
+            k2y, k2q = rhs(t + 0.5 * h, y + 0.5 * h * k1y, Q + 0.5 * h * k1q)
+            k3y, k3q = rhs(t + 0.5 * h, y + 0.5 * h * k2y, Q + 0.5 * h * k2q)
+            k4y, k4q = rhs(t + h, y + h * k3y, Q + h * k3q)
+            y = y + h / 6.0 * (k1y + 2.0 * k2y + 2.0 * k3y + k4y)
+            Q = Q + h / 6.0 * (k1q + 2.0 * k2q + 2.0 * k3q + k4q)
+            t = t + h
+            if n % qr_every and n < n_steps:
+                continue
+            keep = np.all(np.isfinite(y), axis=1) & np.all(np.isfinite(Q), axis=(1, 2))
+            if constraints:
+                keep &= inside_all(constraints, y.T)
+            if not keep.all():
+                log_sum[active[~keep]] = np.nan
+                active, y, Q = active[keep], y[keep], Q[keep]
+                if active.size == 0:
+                    break
+            Q, d = _qr(Q)
+            if t <= t_transient:
+                continue
+            log_sum[active] += np.log(d)
+            previous = exponents[active]
+            exponents = log_sum / (t - t_transient)
+            if history:
+                t_buf.append(t)
+                e_buf.append(exponents)
+            if callback is not None:
+                change = np.abs(exponents[active] - previous)
+                change = np.max(change) if np.all(np.isfinite(change)) else np.inf
+                if callback(Progress(t=t, exponents=exponents, change=change,
+                                     n_active=active.size)):
+                    break
+    if t > t_transient:
+        exponents = log_sum / (t - t_transient)
+    else:
+        exponents = np.full((N, k), np.nan)
+    estimates = (t_buf.trim(), e_buf.trim()) if history else None
+    return Lyapunov(exponents=exponents, t=t, history=estimates)
@@ -1,6 +1,9 @@
 import numpy as np
+from protocol import vectorized
+from observables import quintessence
 
 
+@vectorized
 def compact_dyn_sys_phi2(init, t=None, model_pars=[]):
         '''
         This is the system dy_i/dt = f(y_i)
@@ -22,6 +25,7 @@ def compact_dyn_sys_phi2(init, t=None, model_pars=[]):
         return [X_dot, Y_dot]
 
 
+@vectorized
 def dyn_sys_exp_yukawa_bounded(init, t=None, model_pars=[3.0, 0.0]):
     """Quintessence + Yukawa interaction (bounded vars)"""
     lambda1 = model_pars[0]
@@ -33,12 +37,10 @@ def dyn_sys_exp_yukawa_bounded(init, t=None, model_pars=[3.0, 0.0]):
 
     w_m = 0.0
 
-    if u > 0.0:
-        g = (1.0 - u)
-        f = r * g / (1.0 - 2.0*u)
-    else:
-        g = (1.0 + u)
-        f = r * g
+    # both branches are evaluated, the one not taken may divide by zero
+    with np.errstate(divide='ignore', invalid='ignore'):
+        g = np.where(u > 0.0, 1.0 - u, 1.0 + u)
+        f = np.where(u > 0.0, r * g / (1.0 - 2.0*u), r * g)
 
     A = (1.0 - w_m) * x**2.0 + (1.0 + w_m)*(1.0 - y**2.0)
     Q = np.sqrt(6.0) * f * (1.0 - x**2.0 - y**2.0) / 2.0
@@ -48,3 +50,6 @@ def dyn_sys_exp_yukawa_bounded(init, t=None, model_pars=[3.0, 0.0]):
     u_dot = np.sqrt(6.0) * r * g**2.0 * x
 
     return [x_dot, y_dot, u_dot]
+
+
+quintessence(dyn_sys_exp_yukawa_bounded, w_m=0.0)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        observables.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: Observables of a model: derived quantities of the state such
+             as the density parameter or the equation of state. They are
+             registered on the model (model.observables, like
+             model.vectorized in protocol.py) as whole-array functions
+
+                 func(states, model_pars) -> values
+
+             with states of shape (Ndim, ...), so one call evaluates a
+             whole Orbit.solution or an ensemble slab.
+"""
+import numpy as np
+
+
+def register(model, name, func):
+    """Attach the observable name to model, returns func (decorator-friendly)."""
+    if getattr(model, 'observables', None) is None:
+        model.observables = {}
+    model.observables[name] = func
+    return func
+
+
+def observable(model, name):
+    """Decorator: @observable(model, 'name') registers the function below."""
+    def decorator(func):
+        return register(model, name, func)
+    return decorator
+
+
+def names(model):
+    """Names of the observables registered on model."""
+    return sorted(getattr(model, 'observables', None) or {})
+
+
+def evaluate(model, name, solution, model_pars=[]):
+    """Observable name over solution (..., Ndim), shape solution.shape[:-1]."""
+    registry = getattr(model, 'observables', None) or {}
+    if name not in registry:
+        raise ValueError("model has no observable {!r}, registered: {}".format(
+            name, names(model)))
+    states = np.moveaxis(np.asarray(solution, dtype=float), -1, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.asarray(registry[name](states, model_pars), dtype=float)
+
+
+def quintessence(model, w_m=0.0):
+    """Register the observables of a scalar field model in the variables
+
+        x = phi_dot / (sqrt(6) H),  y = sqrt(V / 3) / H
+
+    (the first two of the state), with a background fluid w_m:
+    Omega_phi, w_phi, w_eff and the deceleration parameter q.
+    Returns model.
+    """
+    @observable(model, 'Omega_phi')
+    def omega_phi(states, model_pars):
+        return states[0]**2.0 + states[1]**2.0
+
+    @observable(model, 'w_phi')
+    def w_phi(states, model_pars):
+        x2, y2 = states[0]**2.0, states[1]**2.0
+        return (x2 - y2) / (x2 + y2)
+
+    @observable(model, 'w_eff')
+    def w_eff(states, model_pars):
+        x2, y2 = states[0]**2.0, states[1]**2.0
+        return x2 - y2 + w_m * (1.0 - x2 - y2)
+
+    @observable(model, 'q')
+    def deceleration(states, model_pars):
+        return 0.5 * (1.0 + 3.0 * w_eff(states, model_pars))
+
+    return model
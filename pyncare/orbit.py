@@ -12,8 +12,18 @@ Description: This contains the more basic class in the package, namely, the
 
 """
 import numpy as np
-from scipy.integrate import odeint
+import hashlib
 import sys
+import time
+import integrators
+from constraints import valid_length
+from protocol import batch_model
+from section import poincare_section
+from lyapunov import lyapunov_spectrum
+from buffers import GrowableArray
+import decimate as lod
+import profiling
+import observables
 from utils import plot_quiver_2D, plot_quiver_3D
 from utils import  plot_quiver_fancy_2D
 
@@ -22,20 +32,55 @@ _arrow_style = "quiver"
 
 
 
+def array_digest(a):
+    """Return a SHA1 hex digest of the content of an array."""
+    a = np.ascontiguousarray(a, dtype=float)
+    return hashlib.sha1(a.view(np.uint8)).hexdigest()
+
+
+def solver_key(method, options=None, dense_output=False):
+    """Hashable identity of the solver settings of a solution."""
+    options = tuple(sorted((k, repr(v)) for k, v in (options or {}).items()))
+    return (method, options, bool(dense_output))
+
+
 class Orbit(object):
     """Orbit is the fundamental class in Pyncare."""
 
-    def __init__(self, init_cond, model, model_pars, t, label='orbit'):
+    def __init__(self, init_cond, model, model_pars, t, label='orbit',
+                 integrator='odeint', integrator_options=None, dense_output=False,
+                 constraints=None):
         self.init_cond = init_cond  # must be an collections.OrderedDict
         self.names = list(init_cond.keys())
-        self.init = list(init_cond.values())
         self.Ndim = len(init_cond)      # int
         self.model = model              # method
         self.model_pars = model_pars    # list
         self.t = t                      # numpy array
         self.label = label
+        self.integrator = integrator    # one of integrators.METHODS
+        if integrator_options is None:
+            integrator_options = dict()
+        self.integrator_options = integrator_options
+        self.dense_output = dense_output
+        if constraints is None:
+            constraints = []
+        self.constraints = constraints  # list of constraints.Constraint
         self.solution = []
+        self.t_solution = None          # times of the rows of solution
+        self.dense = None               # interpolant when dense_output
+        self._dense_grid = None         # grid t asked for, with dense output
+        self._grid_states = None        # dense interpolant on _dense_grid
+        self.solver_info = {}
+        self.n_valid = 0                # rows of solution before leaving the constraints
+        self.terminated = False         # True if a constraint stopped the orbit
+        self.last_step = None           # solver step size at the end, if known
+        self._rows = None               # growable buffers behind extend()
         self.is_solved = False
+        self._cache_key = None          # key of the cached solution
+        self._decimated = {}            # kept rows per view resolution, see decimate.py
+        self._observables = {}          # observable values of the cached solution
+        self.cache_hits = 0
+        self.cache_misses = 0
 
     def __str__(self):
         return "{} is an {} object with init cond: {} = {}".format(self.label,
@@ -43,15 +88,262 @@ class Orbit(object):
                                                                    self.names,
                                                                    self.init)
 
+    @property
+    def init(self):
+        """Initial state, the current values of init_cond (a new list)."""
+        return list(self.init_cond.values())
+
+    @init.setter
+    def init(self, values):
+        for key, value in zip(self.names, values):
+            self.init_cond[key] = value
+
+    def _solution_key(self, t, solver=None):
+        """Identify a solution by (init, model, model_pars, time grid).
+
+        init is read from init_cond, so editing it in place is seen. The
+        solver settings (solver_key(), by default the ones of this orbit)
+        and the constraints are part of the key as well.
+        """
+        if solver is None:
+            solver = solver_key(self.integrator, self.integrator_options, self.dense_output)
+        return (tuple(self.init), self.model, tuple(self.model_pars),
+                np.shape(t), array_digest(t)) + solver + (tuple(self.constraints),)
+
     def evolve(self, t=None):
-        if self.is_solved:
-            pass
+        """Integrate the orbit, reusing the cached solution when possible.
+
+        The solution is only recomputed when the initial conditions, the
+        model, its parameters or the time grid differ from the ones used
+        for the cached solution. With dense_output the solver chooses its
+        own steps over the span of t: solution holds the states at those
+        steps (times in t_solution) and at() interpolates any time.
+        Leaving the constraints stops the integration, the solution is
+        then truncated to its first n_valid rows and terminated is True.
+        """
+        if t is None:
+            t = self.t
+        key = self._solution_key(t)
+        if self.is_solved and key == self._cache_key:
+            self.cache_hits += 1
+            profiling.count('orbit.cache_hits')
+            return
+        self.cache_misses += 1
+        if profiling.ENABLED:
+            t0 = time.perf_counter()
+        result = integrators.integrate(self.model, self.init, t,
+                                       model_pars=self.model_pars,
+                                       method=self.integrator,
+                                       dense_output=self.dense_output,
+                                       constraints=self.constraints,
+                                       **self.integrator_options)
+        self.solution = result.y
+        self.t_solution = result.t
+        self.dense = result.dense
+        self._dense_grid = t if result.dense is not None else None
+        self._grid_states = None
+        self.solver_info = result.info
+        self.n_valid = len(result.y)
+        self.terminated = bool(result.info.get('terminated', False))
+        self.last_step = result.info.get('last_step')
+        self._cache_key = key
+        self.is_solved = True
+        if profiling.ENABLED:
+            profiling.record_orbit(self.label, integrations=1,
+                                   nfev=result.info.get('nfev'),
+                                   steps=result.info.get('n_steps'),
+                                   rejected=result.info.get('n_rejected'),
+                                   seconds=time.perf_counter() - t0)
+
+    def at(self, t):
+        """States at times t from the dense output, shape t.shape + (Ndim,)."""
+        self.evolve()
+        if self.dense is None:
+            sys.exit("Orbit.at needs dense_output=True")
+        return self.dense(t)
+
+    def grid_solution(self):
+        """States of the cached solution at the times of the grid t.
+
+        This is solution itself, except with dense output, where solution
+        holds the solver steps only: the interpolant is then evaluated on
+        the times of t within the integrated span (computed once).
+        """
+        if self.dense is None:
+            return self.solution
+        if self._grid_states is None:
+            t = np.asarray(self._dense_grid, dtype=float)
+            lo, hi = sorted((self.t_solution[0], self.t_solution[-1]))
+            self._grid_states = np.asarray(self.dense(t[(t >= lo) & (t <= hi)]))
+        return self._grid_states
+
+    def poincare_section(self, section, n_crossings=100, t_max=np.inf, **options):
+        """Crossings of a section.Section, see section.poincare_section."""
+        return poincare_section(self.model, [self.init], section,
+                                model_pars=self.model_pars,
+                                n_crossings=n_crossings, t_max=t_max, **options)
+
+    def lyapunov_spectrum(self, t_max=None, **options):
+        """Lyapunov exponents of the orbit, see lyapunov.lyapunov_spectrum.
+
+        t_max defaults to the length of the time grid of the orbit.
+        """
+        if t_max is None:
+            t_max = abs(self.t[-1] - self.t[0])
+        options.setdefault('constraints', self.constraints)
+        return lyapunov_spectrum(self.model, [self.init], t_max,
+                                 model_pars=self.model_pars, **options).exponents[0]
+
+    def evaluate(self, states, t=None):
+        """Evaluate the model over states of shape (Ndim, ...) in one call."""
+        return batch_model(self.model, self.model_pars)(states, t)
+
+    def set_solution(self, solution, t=None, count_miss=True, solver=None):
+        """Store an externally computed solution as the cached one.
+
+        With constraints the solution is truncated (as a view) where the
+        orbit leaves them. count_miss=False when the solution comes from a
+        batch (an ensemble slab), not from integrating this orbit. solver
+        is the solver_key() of the solution when it was not computed with
+        the settings of this orbit: evolve() then integrates again.
+        """
         if t is None:
             t = self.t
-        self.solution = odeint(self.model, self.init, t=t, args=(self.model_pars,))
+        if count_miss:
+            self.cache_misses += 1
+        self._cache_key = self._solution_key(t, solver)
+        self.n_valid = len(solution)
+        self.terminated = False
+        if self.constraints:
+            self.n_valid = int(valid_length(solution, self.constraints))
+            self.terminated = bool(self.n_valid < len(solution))
+        self.solution = solution[:self.n_valid]
+        self.t_solution = t[:self.n_valid]
+        self.dense = None
+        self._drop_derived()
         self.is_solved = True
 
-    def plot_orbit(self, ax, vars_to_plot, **kwargs):
+    def _drop_derived(self):
+        """Forget what was derived from the previous solution (a new one was
+        just stored)."""
+        self._grid_states = None
+        self.last_step = None
+        self._rows = None
+        self._decimated = {}
+        self._observables = {}
+
+    def _buffers(self):
+        """Growable copies of t, t_solution and solution, made on first use."""
+        if self._rows is None or not np.shares_memory(self._rows[2].data, self.solution):
+            rows = (GrowableArray(()), GrowableArray(()), GrowableArray((self.Ndim,)))
+            for buf, data in zip(rows, (self.t, self.t_solution, self.solution)):
+                buf.reserve(2 * len(data))
+                buf.extend(data)
+            self._rows = rows
+        return self._rows
+
+    def extend(self, t_more):
+        """Continue the integration from the last state over the times t_more.
+
+        t_more continues the time grid in its direction (decreasing for
+        backward orbits); a number is the extra duration at the last
+        spacing of t. The solver starts with its last step size where the
+        integrator reports it, and the new rows are appended to buffers
+        growing geometrically: t, t_solution and solution become views of
+        them, and the cached solution stays valid for the extended t.
+        An orbit stopped by a constraint is not extended.
+        """
+        self.evolve()
+        if self.dense_output:
+            sys.exit("Orbit.extend does not support dense_output")
+        if self.terminated:
+            return
+        t_last = self.t_solution[-1]
+        direction = -1.0 if self.t[-1] < self.t[0] else 1.0
+        if np.ndim(t_more) == 0:
+            step = abs(self.t[-1] - self.t[-2])
+            t_more = t_last + direction * step * np.arange(1, int(round(abs(t_more) / step)) + 1)
+        t = np.concatenate([[t_last], np.asarray(t_more, dtype=float)])
+        if len(t) < 2:
+            return
+        if not np.all(direction * np.diff(t) > 0.0):
+            sys.exit("t_more must continue the time grid of the orbit")
+        options = dict(self.integrator_options)
+        name = integrators.first_step_option(self.integrator, self.constraints)
+        if self.last_step and name is not None and name not in options:
+            options[name] = self.last_step
+        result = integrators.integrate(self.model, self.solution[-1], t,
+                                       model_pars=self.model_pars,
+                                       method=self.integrator,
+                                       constraints=self.constraints, **options)
+        grid, times, rows = self._buffers()
+        grid.extend(t[1:])
+        times.extend(result.t[1:])
+        rows.extend(result.y[1:])
+        self.t = grid.data
+        self.t_solution = times.data
+        self.solution = rows.data
+        self.n_valid = len(self.solution)
+        self.terminated = bool(result.info.get('terminated', False))
+        self.last_step = result.info.get('last_step', self.last_step)
+        self._cache_key = self._solution_key(self.t)
+
+    def save(self, path):
+        """Write the solution to the store at path, see store.py."""
+        import store    # store depends on this module
+        self.evolve()
+        store.save(path, [self])
+
+    def load(self, path, mmap=True):
+        """Reuse the stored solution at path if it is still valid.
+
+        Returns True when the solution was restored, see store.restore.
+        """
+        import store
+        return store.restore(path, [self], mmap=mmap) == 1
+
+    def invalidate(self):
+        """Drop the cached solution, next call to evolve() integrates again."""
+        self.solution = []
+        self.t_solution = None
+        self.dense = None
+        self._drop_derived()
+        self.is_solved = False
+        self._cache_key = None
+
+    def observable(self, name, t=None):
+        """Values of the model observable name along the solution (see
+        observables.py), computed once per solution."""
+        self.evolve(t=t)
+        key = (self._cache_key, len(self.solution))
+        cached = self._observables.get(name)
+        if cached is None or cached[0] != key:
+            cached = (key, observables.evaluate(self.model, name, self.solution,
+                                                self.model_pars))
+            self._observables[name] = cached
+        return cached[1]
+
+    def _decimate(self, ax, key, points, mode, max_points):
+        """Rows of points to draw in ax with decimate.reduce(), cached per
+        solution, plotted columns (key) and view resolution."""
+        full_key = (self._cache_key, len(self.solution), key,
+                    lod.resolution_key(ax, points, mode, max_points))
+        rows = self._decimated.get(full_key)
+        if rows is None:
+            if len(self._decimated) > 32:
+                self._decimated.clear()
+            rows = lod.reduce(ax, points, mode=mode, max_points=max_points)
+            self._decimated[full_key] = rows
+        return rows
+
+    @profiling.timed('plot.orbit')
+    def plot_orbit(self, ax, vars_to_plot, decimate=None, max_points=None, **kwargs):
+        """Plot the solution over 2 or 3 variables.
+
+        decimate='minmax' or 'exact' draws a reduced set of rows (see
+        decimate.py); max_points sets the target instead of the axes
+        resolution.
+        """
         if len(vars_to_plot) > 3:
             sys.exit("We can't plot in Ndim > 3")
 
@@ -71,13 +363,26 @@ class Orbit(object):
             ind = list(self.init_cond.keys()).index(key)
             indexes.append(ind)
 
+        solution = self.grid_solution()
+        if decimate is not None:
+            points = solution[:, indexes]
+            solution = solution[self._decimate(ax, tuple(indexes), points,
+                                               decimate, max_points)]
+
         if len(vars_to_plot) is 2:
-            ax.plot(self.solution[:, indexes[0]], self.solution[:, indexes[1]], label=self.label, **kwargs)
+            ax.plot(solution[:, indexes[0]], solution[:, indexes[1]], label=self.label, **kwargs)
         elif len(vars_to_plot) is 3:
-            ax.plot(self.solution[:, indexes[0]], self.solution[:, indexes[1]], self.solution[:, indexes[2]],
+            ax.plot(solution[:, indexes[0]], solution[:, indexes[1]], solution[:, indexes[2]],
                     label=self.label, **kwargs)
 
-    def plot_function(self, ax, indep_vars, function, args=None, **kwargs):
+    @profiling.timed('plot.function')
+    def plot_function(self, ax, indep_vars, function, args=None, decimate=None,
+                      max_points=None, **kwargs):
+        """Plot function(args) over the orbit against indep_vars.
+
+        function may also be the name of a model observable (args are then
+        ignored). decimate and max_points as in plot_orbit().
+        """
         if args is not None and not all(key in self.names for key in args):  # check vars exist
             sys.exit("args are not a subset of vars")
         if not all(key in self.names for key in indep_vars):  # check indep_vars exist
@@ -96,7 +401,9 @@ class Orbit(object):
             ind = list(self.init_cond.keys()).index(key)
             indep_vars_list.append(self.solution[:, ind])
 
-        if args is None:
+        if isinstance(function, str):
+            f = self.observable(function, t=t)
+        elif args is None:
             f = function([self.solution[:, 0], self.solution[:, 1]])
         else:
             args_list = []
@@ -106,6 +413,13 @@ class Orbit(object):
 
             f = function(args_list)
 
+        if decimate is not None:
+            points = np.column_stack(indep_vars_list + [f])
+            key = (tuple(indep_vars), function, None if args is None else tuple(args))
+            rows = self._decimate(ax, key, points, decimate, max_points)
+            indep_vars_list = [x[rows] for x in indep_vars_list]
+            f = np.asarray(f)[rows]
+
         if len(indep_vars) == 1:
             x = indep_vars_list[0]
             ax.plot(x, f, **kwargs)
@@ -114,6 +428,24 @@ class Orbit(object):
             y = indep_vars_list[1]
             ax.plot(x, y, f, **kwargs)
 
+    def plot_observable(self, ax, name, **kwargs):
+        """Plot the observable name against time."""
+        values = self.observable(name)
+        kwargs.setdefault('label', self.label)
+        ax.plot(self.t_solution, values, **kwargs)
+
+    def _flow_rows(self, flow_index):
+        """Rows of grid_solution() for the arrows in flow_index.
+
+        Negative indexes count from the end of the solution, indexes
+        falling outside the solution are dropped.
+        """
+        n = len(self.grid_solution())
+        rows = np.asarray(flow_index, dtype=int)
+        rows = np.where(rows < 0, rows + n, rows)
+        return rows[(rows >= 0) & (rows < n)]
+
+    @profiling.timed('plot.flow_arrows')
     def plot_flow_over_orbit(self, ax, vars_to_plot, flow_index=None, arrow_kws=None):
 
         if arrow_kws is None:
@@ -121,7 +453,7 @@ class Orbit(object):
 
         if flow_index is None:
             sys.exit("flow_index must be a list of integers")
-        if any(not isinstance(x, int) for x in flow_index):
+        if any(not isinstance(x, (int, np.integer)) for x in flow_index):
             print(type(flow_index))
             sys.exit("flow_index must be a list of integers")
 
@@ -133,31 +465,32 @@ class Orbit(object):
             ind = list(self.init_cond.keys()).index(key)
             indexes.append(ind)
 
-        vels = [self.model(init=self.solution[i], model_pars=self.model_pars) for i in flow_index if (i < len(self.solution[:, indexes[0]]))]
-        # print 'vels = ', vels
+        points = self.grid_solution()[self._flow_rows(flow_index)]  # one gather
+        vels = self.evaluate(points.T)                          # one model call
 
         if len(indexes) > 1:
-            x = np.array([self.solution[:, indexes[0]][i] for i in flow_index if (i < len(self.solution[:, indexes[0]]))])
-            y = np.array([self.solution[:, indexes[1]][i] for i in flow_index if (i < len(self.solution[:, indexes[1]]))])
+            x = points[:, indexes[0]]
+            y = points[:, indexes[1]]
 
         if len(indexes) > 2:
-            z = np.array([self.solution[:, indexes[2]][i] for i in flow_index if (i < len(self.solution[:, indexes[2]]))])
+            z = points[:, indexes[2]]
 
         if len(indexes) == 2:
-            U = [vel[indexes[0]] for vel in vels]
-            V = [vel[indexes[1]] for vel in vels]
+            U = vels[indexes[0]]
+            V = vels[indexes[1]]
             if _arrow_style is 'quiver':
                 plot_quiver_2D(ax=ax, x=x, y=y, u=U, v=V, arrow_kws=arrow_kws)
             if _arrow_style is 'fancy':  # Not fully implemented
                 plot_quiver_fancy_2D(ax=ax, x=x, y=y, u=U, v=V, **kwargs)
 
         elif len(indexes) == 3:
-            U = [vel[indexes[0]] for vel in vels]
-            V = [vel[indexes[1]] for vel in vels]
-            W = [vel[indexes[2]] for vel in vels]
+            U = vels[indexes[0]]
+            V = vels[indexes[1]]
+            W = vels[indexes[2]]
             if _arrow_style is 'quiver':
                 plot_quiver_3D(ax=ax, x=x, y=y, z=z, u=U, v=V, w=W, arrow_kws=arrow_kws)
 
+    @profiling.timed('plot.flow_arrows')
     def plot_flow_over_function(self, ax, indep_vars, function, function_dot,
                                 flow_index, args=None, arrow_kws=None):
         if arrow_kws is None:
@@ -165,7 +498,7 @@ class Orbit(object):
 
         if flow_index is None:
             sys.exit("flow_index must be a list of integers")
-        if any(not isinstance(x, int) for x in flow_index):
+        if any(not isinstance(x, (int, np.integer)) for x in flow_index):
             print(type(flow_index))
             sys.exit("flow_index must be a list of integers")
 
@@ -179,17 +512,17 @@ class Orbit(object):
             indexes.append(ind)
             indep_vars_list.append(self.solution[:, ind])
 
-        if self.Ndim > 0:
-            x = np.array([self.solution[:, 0][i] for i in flow_index if (i < len(self.solution[:, 0]))])
-        if self.Ndim > 1:
-            y = np.array([self.solution[:, 1][i] for i in flow_index if (i < len(self.solution[:, 1]))])
+        points = self.grid_solution()[self._flow_rows(flow_index)]  # one gather
+        x = points[:, 0]
+        y = points[:, 1]
 
         f = function([x, y])
 
         f_dot = function_dot([x, y])
 
-        if self.Ndim == 2:
-            U, V = zip(*[self.model(init=[x1, y1], model_pars=self.model_pars) for x1, y1 in zip(x, y)])
+        vels = self.evaluate(points.T)                          # one model call
+        U = vels[0]
+        V = vels[1]
 
         if len(indep_vars) == 1:
             if _arrow_style is 'quiver':
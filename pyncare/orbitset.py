@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        orbitset.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: Columnar collection of orbits. Instead of one dictionary and
+             one Orbit object per orbit, an OrbitSet keeps
+
+                 inits        (N, Ndim) initial conditions
+                 grids        the distinct time grids, t_id (N,) the grid
+                              of each orbit (one grid when t is shared)
+                 labels       (N,) strings
+                 arrow_pos    flat indexes, rows i in
+                              arrow_offsets[i]:arrow_offsets[i+1]
+                 slabs        solutions (n, N_t, Ndim) of groups of orbits
+
+             Orbit objects are only built when asked for (set[i]) and are
+             kept afterwards; their solution is a view into the slabs.
+             Initial conditions edited through a view (init_cond) are
+             written back to inits when it is read.
+"""
+import collections
+import numpy as np
+import orbit
+import observables
+from orbit import array_digest
+
+
+class OrbitSet(object):
+    """Initial conditions, time grids, labels and arrows of N orbits.
+
+    Behaves as a sequence of orbit.Orbit, built on demand with the
+    settings given to configure() (model, model_pars, integrator...).
+    """
+
+    def __init__(self, names, inits, grids, t_id, labels, arrow_pos, arrow_offsets):
+        self.names = list(names)
+        self._inits = np.asarray(inits, dtype=float)
+        self.Ndim = len(self.names)
+        if self._inits.ndim != 2 or self._inits.shape[1] != self.Ndim:
+            raise ValueError("inits must have shape (N, {})".format(self.Ndim))
+        self.grids = [np.asarray(g, dtype=float) for g in grids]
+        self.t_id = np.asarray(t_id, dtype=np.intp)
+        self.labels = np.asarray(labels, dtype=str)
+        self.arrow_pos = np.asarray(arrow_pos, dtype=np.intp)
+        self.arrow_offsets = np.asarray(arrow_offsets, dtype=np.intp)
+        self.orbit_kwargs = {}
+        self.slabs = []                                     # (index, slab)
+        self._slab_solver = []                              # orbit.solver_key of each slab
+        self.slab_misses = 0                                # orbits integrated in slabs
+        self._slab_of = np.full(len(self._inits), -1, dtype=np.intp)
+        self._slab_row = np.zeros(len(self._inits), dtype=np.intp)
+        self._views = {}
+        self._observables = {}                              # (slab, name) -> values
+
+    @classmethod
+    def from_arrays(cls, names, inits, t, labels=None, arrow_pos=None):
+        """Build the set from arrays without per orbit Python objects.
+
+        t is one grid shared by all the orbits, or a sequence of N grids.
+        labels default to 'orbit_<i>'. arrow_pos is None, an (N, k) integer
+        array or a sequence of N lists of indexes.
+        """
+        inits = np.atleast_2d(np.asarray(inits, dtype=float))
+        N = len(inits)
+        if (isinstance(t, np.ndarray) and t.ndim == 1) or np.isscalar(t[0]):
+            grids, t_id = [np.asarray(t, dtype=float)], np.zeros(N, dtype=np.intp)
+        else:
+            if len(t) != N:
+                raise ValueError("give one time grid per orbit, or a shared one")
+            grids, t_id = _unique_grids(t)
+        if labels is None:
+            labels = np.char.add('orbit_', np.arange(N).astype(str))
+        if arrow_pos is None:
+            flat, offsets = np.zeros(0, dtype=np.intp), np.zeros(N + 1, dtype=np.intp)
+        elif isinstance(arrow_pos, np.ndarray) and arrow_pos.ndim == 2:
+            flat = arrow_pos.ravel()
+            offsets = np.arange(N + 1) * arrow_pos.shape[1]
+        else:
+            lengths = [len(a) for a in arrow_pos]
+            flat = np.array([i for a in arrow_pos for i in a], dtype=np.intp)
+            offsets = np.concatenate([[0], np.cumsum(lengths)])
+        return cls(names, inits, grids, t_id, labels, flat, offsets)
+
+    @classmethod
+    def from_dicts(cls, orbits):
+        """Build the set from the list of dicts taken by BaseDynSys:
+
+            [{'vars': OrderedDict([('x', x0), ...]), 't': t,
+              'arrow_pos': [...], 'label': label}, ...]
+        """
+        names = list(orbits[0]['vars'].keys())
+        inits = [[orb['vars'][key] for key in names] for orb in orbits]
+        return cls.from_arrays(names, inits, [orb['t'] for orb in orbits],
+                               labels=[orb['label'] for orb in orbits],
+                               arrow_pos=[orb.get('arrow_pos', []) for orb in orbits])
+
+    @property
+    def inits(self):
+        """(N, Ndim) initial conditions, with the edits made through the
+        built views written back (those orbits leave their slab)."""
+        for i, view in self._views.items():
+            init = view.init
+            if not np.array_equal(self._inits[i], init):
+                self._inits[i] = init
+                self._slab_of[i] = -1
+        return self._inits
+
+    def configure(self, **orbit_kwargs):
+        """Set the keyword arguments of the Orbit views, dropping old views."""
+        self.orbit_kwargs = orbit_kwargs
+        self._views = {}
+        self._observables = {}
+
+    def __len__(self):
+        return len(self._inits)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        view = self._views.get(i)
+        if view is None:
+            view = self._make_view(i)
+            self._views[i] = view
+        return view
+
+    def _make_view(self, i):
+        init_cond = collections.OrderedDict(zip(self.names, self._inits[i].tolist()))
+        view = orbit.Orbit(init_cond, t=self.t(i), label=str(self.labels[i]),
+                           **self.orbit_kwargs)
+        if self._slab_of[i] >= 0:
+            view.set_solution(self.solution(i), t=self.t(i), count_miss=False,
+                              solver=self._slab_solver[self._slab_of[i]])
+        return view
+
+    def views(self):
+        """(index, Orbit) of the views built so far, without building others."""
+        return sorted(self._views.items())
+
+    def _solver(self):
+        """solver_key of the settings of the views."""
+        kw = self.orbit_kwargs
+        return orbit.solver_key(kw.get('integrator', 'odeint'), kw.get('integrator_options'),
+                                kw.get('dense_output', False))
+
+    def pending(self):
+        """Indexes of the orbits without a valid solution: not in a slab
+        integrated with the settings of the views and without a solved view
+        (a view, when built, decides)."""
+        self.inits      # write back the edits of the views
+        valid = np.array([s == self._solver() for s in self._slab_solver] + [False])
+        solved = valid[self._slab_of]   # -1 (no slab) picks the last, False
+        for i, view in self._views.items():
+            solved[i] = view.is_solved and view._cache_key == view._solution_key(view.t)
+        return np.flatnonzero(~solved)
+
+    def t(self, i):
+        """Time grid of orbit i."""
+        return self.grids[self.t_id[i]]
+
+    def arrows(self, i):
+        """Indexes of the rows of orbit i where flow arrows are drawn."""
+        return self.arrow_pos[self.arrow_offsets[i]:self.arrow_offsets[i + 1]]
+
+    def groups(self, index=None):
+        """(orbit indexes, time grid) of the orbits (of index, by default
+        all) sharing each grid."""
+        if index is None:
+            index = np.arange(len(self))
+        index = np.asarray(index, dtype=np.intp)
+        t_id = self.t_id[index]
+        return [(index[t_id == k], grid)
+                for k, grid in enumerate(self.grids) if np.any(t_id == k)]
+
+    def add_slab(self, index, slab, solver=None):
+        """Record the solutions slab (n, N_t, Ndim) of the orbits index,
+        integrated on the grid of their group with solver (an
+        orbit.solver_key, by default the settings of the views).
+
+        Orbit views already built get their row of the slab as solution.
+        """
+        if solver is None:
+            solver = self._solver()
+        self.slab_misses += len(index)
+        self._slab_of[index] = len(self.slabs)
+        self._slab_row[index] = np.arange(len(index))
+        self.slabs.append((np.asarray(index), slab))
+        self._slab_solver.append(solver)
+        for row, i in enumerate(index):
+            if i in self._views:
+                self._views[i].set_solution(slab[row], t=self.t(i), count_miss=False,
+                                            solver=solver)
+
+    def solution(self, i):
+        """Row of orbit i in its slab (untruncated), or None."""
+        k = self._slab_of[i]
+        if k < 0:
+            return None
+        return self.slabs[k][1][self._slab_row[i]]
+
+    def slab_observable(self, k, name):
+        """Observable name over the whole slab k, (n, N_t), computed once."""
+        values = self._observables.get((k, name))
+        if values is None:
+            values = observables.evaluate(self.orbit_kwargs['model'], name, self.slabs[k][1],
+                                          self.orbit_kwargs.get('model_pars', []))
+            self._observables[(k, name)] = values
+        return values
+
+    def observable(self, i, name):
+        """Row of orbit i in slab_observable() (untruncated), or None."""
+        k = self._slab_of[i]
+        if k < 0:
+            return None
+        return self.slab_observable(k, name)[self._slab_row[i]]
+
+    def clear_slabs(self):
+        self.slabs = []
+        self._slab_solver = []
+        self._slab_of[:] = -1
+        self._observables = {}
+
+
+def _unique_grids(ts):
+    """Distinct grids of the sequence ts and the index of each in them."""
+    grids, t_id, seen = [], np.empty(len(ts), dtype=np.intp), {}
+    for i, t in enumerate(ts):
+        t = np.asarray(t, dtype=float)
+        key = (t.shape, array_digest(t))
+        if key not in seen:
+            seen[key] = len(grids)
+            grids.append(t)
+        t_id[i] = seen[key]
+    return grids, t_id
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        parallel.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: Evolve independent orbits in a pool of processes. The time
+             grids (each distinct one once) and the solutions live in one
+             shared memory block: workers read the grids and write their
+             solutions straight into it, so only the initial conditions
+             and offsets travel through pickle.
+"""
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import integrators
+
+
+class EvolveError(RuntimeError):
+    """An orbit failed to evolve in a worker process."""
+
+    def __init__(self, label, message):
+        RuntimeError.__init__(self, label, message)
+        self.label = label
+
+    def __str__(self):
+        return "orbit '{}' failed: {}".format(self.args[0], self.args[1])
+
+
+def _evolve_chunk(shm_name, model, model_pars, method, options, constraints, tasks):
+    """Worker: integrate each (label, offset, init, t_offset, n_t) into the
+    shared block, the grid being the n_t floats at t_offset."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    grids = {}
+    try:
+        for label, offset, init, t_offset, n_t in tasks:
+            t = grids.get(t_offset)
+            if t is None:   # a private copy, no view outlives the block
+                t = grids[t_offset] = np.ndarray((n_t,), dtype=float, buffer=shm.buf,
+                                                 offset=t_offset).copy()
+            out = np.ndarray((len(t), len(init)), dtype=float,
+                             buffer=shm.buf, offset=offset)
+            try:
+                y = integrators.integrate(model, init, t, model_pars=model_pars,
+                                          method=method, constraints=constraints,
+                                          **options).y
+                out[:len(y)] = y
+                out[len(y):] = np.nan  # stopped by a constraint
+            except Exception as exc:
+                del out  # release the buffer before closing
+                raise EvolveError(label, repr(exc))
+            del out
+    finally:
+        shm.close()
+
+
+def evolve_orbits(orbits, n_workers=None, chunksize=None):
+    """Evolve the given Orbit objects in a process pool.
+
+    The orbits must share model, model_pars and integrator settings and
+    must not use dense output (their length is not known in advance).
+
+    All the solutions are gathered in one contiguous buffer, the Orbit
+    objects keep views into it. Returns that buffer.
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    model = orbits[0].model
+    model_pars = orbits[0].model_pars
+    method = orbits[0].integrator
+    options = orbits[0].integrator_options
+    constraints = orbits[0].constraints
+
+    sizes = [len(orb.t) * orb.Ndim for orb in orbits]
+    offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(int)
+    grids = {}      # id of a grid -> its offset (in floats) after the solutions
+    size = int(offsets[-1])
+    for orb in orbits:  # orbits of an OrbitSet share their grid objects
+        if id(orb.t) not in grids:
+            grids[id(orb.t)] = size
+            size += len(orb.t)
+    nbytes = max(size * 8, 1)
+    tasks = [(orb.label, int(offsets[i]) * 8, list(orb.init), grids[id(orb.t)] * 8,
+              len(orb.t)) for i, orb in enumerate(orbits)]
+    if chunksize is None:
+        chunksize = max(1, len(tasks) // (4 * n_workers))
+    chunks = [tasks[i:i + chunksize] for i in range(0, len(tasks), chunksize)]
+
+    shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    try:
+        block = np.ndarray((size,), dtype=float, buffer=shm.buf)
+        for orb in orbits:
+            start = grids[id(orb.t)]
+            block[start:start + len(orb.t)] = orb.t
+        del block   # release the buffer before closing
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [pool.submit(_evolve_chunk, shm.name, model, model_pars,
+                                   method, options, constraints, chunk)
+                       for chunk in chunks]
+            for future in futures:  # in submission order, first failure wins
+                future.result()
+        buf = np.ndarray((int(offsets[-1]),), dtype=float, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+    for i, orb in enumerate(orbits):
+        sol = buf[offsets[i]:offsets[i + 1]].reshape(len(orb.t), orb.Ndim)
+        orb.set_solution(sol)
+    return buf
@@ -10,17 +10,41 @@ Description: ToDo
 import numpy as np
 from itertools import cycle
 from dynsysbase import BaseDynSys
+from protocol import batch_model
+from constraints import Ball
+from symbolic import compactify
 from utils import plot_sphere
 from utils import plot_latitude
 from utils import plot_circle
+import profiling
 
 
 class PoincareCompact(BaseDynSys):
-    """Dyn Sys in Caompact coordinates."""
-
-    def __init__(self, **kwargs):
+    """Dyn Sys in Caompact coordinates.
+
+    By default orbits stop when they leave the unit disk (ball) of the
+    compact variables, where Z = sqrt(1 - X**2 - Y**2) is not defined.
+
+    Instead of a model already written in compact variables, the
+    original_model may be given as a symbolic.SymbolicModel; its compact
+    field (see symbolic.compactify) is then built and used as the model.
+    That field is finite on the equator, which is invariant: orbits reach
+    it only asymptotically and the default ball gets a small tolerance.
+    With the default ball the integrator defaults to 'LSODA'.
+    """
+
+    def __init__(self, original_model=None, degree=None, **kwargs):
+        margin = 0.0
+        if original_model is not None:
+            kwargs['model'] = compactify(original_model, degree=degree)
+            kwargs.setdefault('Ndim', original_model.Ndim)
+            margin = -1e-6
+        if kwargs.get('constraints') is None:
+            kwargs['constraints'] = [Ball(index=range(kwargs.get('Ndim', 2)), margin=margin)]
+            kwargs.setdefault('integrator', 'LSODA')    # odeint can not stop on it
         super(PoincareCompact, self).__init__(**kwargs)
 
+    @profiling.timed('plot.orbits')
     def plot_orbits(self, ax, vars_to_plot=['x', 'y'], add_flow=True,
                     colors=None, arrow_kws=None, **kwargs):
         if arrow_kws is None:
@@ -43,15 +67,26 @@ class PoincareCompact(BaseDynSys):
                 orb.plot_flow_over_function(ax, indep_vars=vars_to_plot,
                                         function=self.sphere_z,
                                         function_dot=self.sphere_z_dot,
-                                        flow_index=self.orbits[i]['arrow_pos'],
+                                        flow_index=self.orbit_set.arrows(i),
                                         arrow_kws=arrow_kws
                                         )
             ax.set_xlabel(self.var_names[vars_to_plot[0]])
             ax.set_ylabel(self.var_names[vars_to_plot[1]])
             ax.set_zlabel(r'$Z$')
 
+    @profiling.timed('plot.vertical_projection')
     def plot_vertical_projection(self, ax, vars_to_plot=['x', 'y'], add_flow=True, colors=None,
-                                 arrow_kws=None, **kwargs):
+                                 arrow_kws=None, density=False, **kwargs):
+        """Plot the orbits over the disk of vars_to_plot.
+
+        With density=True the orbits are drawn as one density image over
+        the unit disk instead (see BaseDynSys.plot_density, which takes
+        the kwargs).
+        """
+        if density:
+            kwargs.setdefault('extent', (-1.0, 1.0, -1.0, 1.0))
+            return self.plot_density(ax, vars_to_plot=vars_to_plot, **kwargs)
+
         if arrow_kws is None:
             arrow_kws = dict()
 
@@ -69,7 +104,7 @@ class PoincareCompact(BaseDynSys):
             if add_flow:
                 arrow_kws['color'] = color
                 orb.plot_flow_over_orbit(ax, vars_to_plot=vars_to_plot,
-                                         flow_index=self.orbits[i]['arrow_pos'], arrow_kws=arrow_kws)
+                                         flow_index=self.orbit_set.arrows(i), arrow_kws=arrow_kws)
 
             ax.set_xlabel(self.var_names[vars_to_plot[0]])
             ax.set_ylabel(self.var_names[vars_to_plot[1]])
@@ -83,7 +118,7 @@ class PoincareCompact(BaseDynSys):
         X = np.array(args[0])
         Y = np.array(args[1])
         Z = self.sphere_z([X, Y])
-        U, V = self.model([X, Y])
+        U, V = batch_model(self.model, self.model_pars)([X, Y])
         return (- X * U - Y * V)/Z
 
     def plot_poincare_surface(self, ax, phi_i=0, phi_f=2.0*np.pi,
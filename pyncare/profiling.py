@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        profiling.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: Opt-in instrumentation. When enabled (enable(), the enabled()
+             context or PYNCARE_PROFILE=1 in the environment) pyncare
+             records
+
+                 stages     calls and wall time of each named stage
+                            (integration, flow arrows, plotting...)
+                 counters   model (RHS) calls and evaluated states, solver
+                            steps and rejections, cache hits
+                 orbits     the same statistics per orbit label
+
+             When disabled, stage() returns a shared null context and the
+             counters are guarded by the module flag, so the cost is one
+             attribute lookup per instrumented call.
+"""
+import collections
+import contextlib
+import functools
+import logging
+import os
+import time
+import numpy as np
+
+ENABLED = os.environ.get('PYNCARE_PROFILE', '') not in ('', '0')
+
+logger = logging.getLogger('pyncare.profiling')
+
+Report = collections.namedtuple('Report', ['stages', 'counters', 'orbits'])
+
+_stages = {}        # name -> [calls, seconds]
+_counters = collections.Counter()
+_orbits = collections.defaultdict(collections.Counter)
+_NULL = contextlib.nullcontext()
+
+
+def enable(flag=True):
+    global ENABLED
+    ENABLED = bool(flag)
+
+
+def disable():
+    enable(False)
+
+
+def reset():
+    """Forget everything recorded so far."""
+    _stages.clear()
+    _counters.clear()
+    _orbits.clear()
+
+
+@contextlib.contextmanager
+def enabled(clear=True):
+    """Profile the block, (by default) starting from empty records."""
+    previous = ENABLED
+    if clear:
+        reset()
+    enable()
+    try:
+        yield
+    finally:
+        enable(previous)
+
+
+class _Stage(object):
+    __slots__ = ('name', 't0')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record = _stages.setdefault(self.name, [0, 0.0])
+        record[0] += 1
+        record[1] += time.perf_counter() - self.t0
+        return False
+
+
+def stage(name):
+    """Context manager timing the stage name (a no-op when disabled)."""
+    if ENABLED:
+        return _Stage(name)
+    return _NULL
+
+
+def timed(name):
+    """Decorator timing every call of the function as the stage name."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with _Stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    if ENABLED:
+        _counters[name] += n
+
+
+def record_orbit(label, **stats):
+    """Add the statistics (numbers) of one integration of the orbit label."""
+    if ENABLED:
+        _orbits[label].update(dict((k, v) for k, v in stats.items() if v is not None))
+        _counters.update(dict(('orbit.' + k, v) for k, v in stats.items()
+                              if v is not None and k != 'seconds'))
+
+
+def counted(model, tally):
+    """model wrapped to add its calls and evaluated states to tally (a
+    Counter), keeping the attributes of model (vectorized, jacobian...).
+    The wrapper is transparent to protocol.is_vectorized: the probe of an
+    undeclared model is cached on model and not counted."""
+    @functools.wraps(model)
+    def wrapper(init, t=None, model_pars=[]):
+        tally['rhs_calls'] += 1
+        tally['rhs_states'] += int(np.prod(np.shape(init)[1:], dtype=int))
+        return model(init, t, model_pars)
+    for name in ('vectorized', 'jacobian', 'observables'):
+        if hasattr(model, name):
+            setattr(wrapper, name, getattr(model, name))
+    return wrapper
+
+
+def report():
+    """Report(stages, counters, orbits) of the records so far, as plain dicts:
+    stages {name: {'calls', 'seconds'}}, counters {name: n} and orbits
+    {label: {name: n}}."""
+    stages = dict((name, {'calls': calls, 'seconds': seconds})
+                  for name, (calls, seconds) in _stages.items())
+    return Report(stages=stages, counters=dict(_counters),
+                  orbits=dict((label, dict(c)) for label, c in _orbits.items()))
+
+
+def log_report(rep=None, level=logging.INFO):
+    """Emit a report (the current one by default) through logging."""
+    if rep is None:
+        rep = report()
+    for name, s in sorted(rep.stages.items(), key=lambda item: -item[1]['seconds']):
+        logger.log(level, "stage %-28s calls %8d  time %10.4f s", name, s['calls'],
+                   s['seconds'])
+    for name, n in sorted(rep.counters.items()):
+        logger.log(level, "count %-28s %12g", name, n)
+    logger.log(level, "orbits profiled: %d", len(rep.orbits))
+    return rep
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        protocol.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: The calling convention of the models. A model is a function
+
+                 model(init, t=None, model_pars=[]) -> [x1_dot, x2_dot, ...]
+
+             where init[i] is the i-th variable. A model is *vectorized*
+             when init[i] may be an array (a trailing batch axis) and the
+             returned velocities are arrays with the same batch shape.
+             batch_model() wraps any model so it can be evaluated over
+             states of shape (Ndim, ...) in one call, looping point by
+             point only for scalar-only models.
+"""
+import numpy as np
+import weakref
+
+_probed = weakref.WeakKeyDictionary()   # model -> bool, probe results
+
+
+def vectorized(model):
+    """Decorator declaring that model accepts a trailing batch axis."""
+    model.vectorized = True
+    return model
+
+
+def scalar(model):
+    """Decorator declaring that model only accepts one point per call."""
+    model.vectorized = False
+    return model
+
+
+def _probe_points(Ndim):
+    """A few points well inside the unit ball, not aligned on any axis."""
+    base = np.array([0.11, -0.23, 0.07, 0.19, -0.05, 0.13])
+    cols = [np.roll(base, k)[:Ndim] for k in range(3)]
+    return np.array([np.resize(c, Ndim) for c in cols]).T  # (Ndim, 3)
+
+
+def _probe(model, Ndim, model_pars):
+    """Check if model gives the same result on a batch than point by point."""
+    points = _probe_points(Ndim)
+    with np.errstate(all='ignore'):
+        try:
+            batch = np.array(np.broadcast_arrays(*model(points, None, model_pars)),
+                             dtype=float)
+        except Exception:
+            return False
+        if batch.shape != points.shape:
+            return False
+        loop = np.array([model(list(p), None, model_pars) for p in points.T],
+                        dtype=float).T
+    return np.allclose(batch, loop, equal_nan=True)
+
+
+def is_vectorized(model, Ndim, model_pars=[]):
+    """Return the declared vectorized flag of model, or probe it.
+
+    A transparent wrapper (functools.wraps, e.g. profiling.counted) is
+    resolved to the model it wraps, so the probe runs and is cached once.
+    """
+    model = getattr(model, '__wrapped__', model)
+    flag = getattr(model, 'vectorized', None)
+    if flag is not None:
+        return flag
+    try:
+        return _probed[model]
+    except (KeyError, TypeError):
+        pass
+    flag = _probe(model, Ndim, model_pars)
+    try:
+        _probed[model] = flag
+    except TypeError:   # not weak-referenceable (e.g. a bound method)
+        pass
+    return flag
+
+
+def batch_model(model, model_pars=[]):
+    """Wrap model as f(states, t=None) -> velocities with shape of states.
+
+    states has shape (Ndim, ...), any trailing axes are batch axes.
+    Vectorized models are called once; scalar-only models are evaluated
+    in a loop over the flattened batch.
+    """
+    state = {}
+
+    def f(states, t=None):
+        states = np.asarray(states, dtype=float)
+        Ndim = states.shape[0]
+        if 'vectorized' not in state:
+            state['vectorized'] = is_vectorized(model, Ndim, model_pars)
+        if state['vectorized']:
+            return np.array(np.broadcast_arrays(*model(states, t, model_pars)))
+        flat = states.reshape(Ndim, -1)
+        out = np.empty_like(flat)
+        for j in range(flat.shape[1]):
+            out[:, j] = model(list(flat[:, j]), t, model_pars)
+        return out.reshape(states.shape)
+    return f
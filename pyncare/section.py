@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        section.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: Poincare sections. A Section is a surface g(state) = 0 crossed
+             in a given direction. poincare_section() integrates a batch of
+             orbits with the Dormand-Prince stepper of ensemble.py, without
+             storing trajectories, and refines every crossing on the cubic
+             Hermite interpolant of the step. Crossing points are streamed
+             into growable arrays.
+"""
+import collections
+import numpy as np
+import warnings
+from buffers import GrowableArray
+from ensemble import batch_rhs, dp45_step, error_norm, step_factor, _stack
+
+Crossings = collections.namedtuple('Crossings', ['t', 'points', 'orbit'])
+
+
+class Section(object):
+    """Surface of section g(state) = 0.
+
+    Define it either by a function g of states with shape (Ndim, ...)
+    or by a hyperplane normal . state = offset. direction=1 keeps the
+    crossings where g goes from negative to positive along the
+    integration, direction=-1 the opposite ones and direction=0 both.
+    """
+
+    def __init__(self, func=None, normal=None, offset=0.0, direction=1):
+        if (func is None) == (normal is None):
+            raise ValueError("Define the section either by func or by normal")
+        if direction not in (-1, 0, 1):
+            raise ValueError("direction must be -1, 0 or 1")
+        self.func = func
+        self.normal = None if normal is None else np.asarray(normal, dtype=float)
+        self.offset = offset
+        self.direction = direction
+
+    def __call__(self, states):
+        states = np.asarray(states, dtype=float)
+        if self.func is not None:
+            return np.asarray(self.func(states), dtype=float)
+        return np.tensordot(self.normal, states, axes=1) - self.offset
+
+    def crossed(self, g0, g1):
+        """Mask of the steps going from g0 to g1 through the section."""
+        up = (g0 < 0.0) & (g1 >= 0.0)
+        down = (g0 > 0.0) & (g1 <= 0.0)
+        if self.direction == 1:
+            return up
+        if self.direction == -1:
+            return down
+        return up | down
+
+
+def _hermite(theta, hs, y0, f0, y1, f1):
+    """Cubic Hermite interpolant of a step, theta in [0, 1] per orbit."""
+    th = theta[:, np.newaxis]
+    th2 = th * th
+    th3 = th2 * th
+    return ((2.0 * th3 - 3.0 * th2 + 1.0) * y0 + (th3 - 2.0 * th2 + th) * hs * f0 +
+            (-2.0 * th3 + 3.0 * th2) * y1 + (th3 - th2) * hs * f1)
+
+
+def _refine(section, step, g0, n_iter=50):
+    """Bisection on the interpolant, vectorized over the crossing orbits."""
+    lo = np.zeros(len(g0))
+    hi = np.ones(len(g0))
+    s0 = np.sign(g0)
+    for i in range(n_iter):
+        mid = 0.5 * (lo + hi)
+        same = np.sign(section(_hermite(mid, *step).T)) == s0
+        lo = np.where(same, mid, lo)
+        hi = np.where(same, hi, mid)
+    return 0.5 * (lo + hi)
+
+
+def poincare_section(model, inits, section, model_pars=[], n_crossings=100,
+                     t0=0.0, t_max=np.inf, rtol=1e-8, atol=1e-10,
+                     first_step=1e-2, max_step=np.inf, max_steps=None,
+                     capacity=1024):
+    """Collect up to n_crossings crossings of section for each orbit.
+
+    All the orbits advance together with a shared adaptive step; an orbit
+    leaves the batch once it has n_crossings crossings or its state is no
+    longer finite. A negative t_max integrates backwards. Give a finite
+    t_max or max_steps when some orbit may never cross the section.
+    Returns Crossings(t, points, orbit) in integration order, orbit being
+    the index of the initial condition of each crossing.
+    """
+    y = _stack(inits)
+    Ndim = y.shape[1]
+    f = batch_rhs(model, model_pars)
+    direction = -1.0 if t_max < t0 else 1.0
+    orbit = np.arange(y.shape[0])
+    counts = np.zeros(y.shape[0], dtype=int)
+
+    t_buf = GrowableArray((), capacity=capacity)
+    p_buf = GrowableArray((Ndim,), capacity=capacity)
+    o_buf = GrowableArray((), dtype=int, capacity=capacity)
+
+    tk = t0
+    k1 = f(tk, y)
+    g_prev = section(y.T)
+    h = first_step
+    h_min = 1e-14 * max(abs(tk), 1.0)
+    steps = 0
+    while y.shape[0] > 0 and direction * (t_max - tk) > 0.0:
+        if max_steps is not None and steps >= max_steps:
+            break
+        steps += 1
+        h = min(h, max_step, abs(t_max - tk))
+        hs = direction * h
+        y_new, k, err = dp45_step(f, tk, y, k1, hs)
+        err = error_norm(err, y, y_new, atol, rtol)
+        accepted = err <= 1.0
+        if accepted or h <= h_min:
+            if not accepted:
+                warnings.warn("poincare_section: step size underflow at t={}".format(tk))
+            g_new = section(y_new.T)
+            hit = section.crossed(g_prev, g_new)
+            if hit.any():
+                step = (hs, y[hit], k1[hit], y_new[hit], k[6][hit])
+                theta = _refine(section, step, g_prev[hit])
+                t_buf.extend(tk + theta * hs)
+                p_buf.extend(_hermite(theta, *step))
+                o_buf.extend(orbit[hit])
+                counts[hit] += 1
+            tk = tk + hs
+            y, k1, g_prev = y_new, k[6], g_new
+            keep = (counts < n_crossings) & np.isfinite(y).all(axis=1)
+            if not keep.all():
+                y, k1, g_prev = y[keep], k1[keep], g_prev[keep]
+                orbit, counts = orbit[keep], counts[keep]
+            h_min = 1e-14 * max(abs(tk), 1.0)
+        h = max(h * step_factor(err, accepted), h_min)
+    return Crossings(t=t_buf.trim(), points=p_buf.trim(), orbit=o_buf.trim())
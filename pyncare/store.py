@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        store.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: On-disk store of orbit solutions. A store is a directory of
+             columns saved as .npy files plus a meta.json:
+
+                 inits.npy      (N_orbits, Ndim)  initial conditions
+                 t.npy          (N_rows,)         times of all the solutions
+                 solution.npy   (N_rows, Ndim)    states of all the solutions
+                 offsets.npy    (N_orbits + 1,)   rows of orbit i are
+                                                  offsets[i]:offsets[i+1]
+                 meta.json      labels, model, model_pars, integrator and
+                                one content digest per orbit
+
+             Columns are opened as np.memmap, the restored solutions are
+             views on them. The digest of an orbit covers everything its
+             solution depends on (initial conditions, model code and
+             parameters, time grid, integrator, constraints), so a stored
+             solution is only reused while none of them changed. The model
+             code covers the values of its closure and of the module
+             globals it reads (numbers, strings, arrays, functions); for
+             anything else give the model an explicit `identity` string.
+"""
+import hashlib
+import json
+import os
+import numpy as np
+from orbit import array_digest
+
+FORMAT = 1
+_COLUMNS = ('inits', 't', 'solution', 'offsets')
+
+
+def _names(code):
+    """Global names read by code and the functions defined in it."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, 'co_names'):
+            names |= _names(const)
+    return names
+
+
+def _value_identity(value, seen):
+    """Stable text for a value a model depends on, None when it has none
+    (modules, classes, arbitrary objects)."""
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        return repr(value)
+    if isinstance(value, np.ndarray):
+        try:
+            return 'array{}:{}'.format(value.shape, array_digest(value))
+        except (TypeError, ValueError):
+            return None
+    if isinstance(value, (tuple, list)):
+        items = [_value_identity(v, seen) for v in value]
+        return None if None in items else '[{}]'.format(', '.join(items))
+    if hasattr(value, '__code__'):
+        return model_identity(value, seen)
+    return None
+
+
+def model_identity(model, _seen=None):
+    """Name and code digest of a model, stable across sessions.
+
+    The digest covers the code, the values of the closure and those of
+    the module globals read by the code (functions recursively). An
+    `identity` attribute on the model is used as it is.
+    """
+    identity = getattr(model, 'identity', None)
+    if isinstance(identity, str):
+        return identity
+    source = getattr(model, 'source', None)     # symbolic.SymbolicModel
+    if source is not None:
+        return 'symbolic:' + hashlib.sha1(source.encode('utf-8')).hexdigest()
+    code = getattr(model, '__code__', None)
+    name = '{}.{}'.format(getattr(model, '__module__', '?'),
+                          getattr(model, '__qualname__', type(model).__name__))
+    if code is None:
+        return name
+    seen = set() if _seen is None else _seen
+    if id(model) in seen:       # recursion
+        return name
+    seen.add(id(model))
+    parts = [code.co_code, repr(code.co_consts).encode('utf-8')]
+    for cell in getattr(model, '__closure__', None) or ():
+        try:
+            parts.append(str(_value_identity(cell.cell_contents, seen)).encode('utf-8'))
+        except ValueError:      # empty cell
+            parts.append(b'<empty>')
+    namespace = getattr(model, '__globals__', {})
+    for key in sorted(_names(code)):
+        if key in namespace:
+            value = _value_identity(namespace[key], seen)
+            if value is not None:
+                parts.append('{}={}'.format(key, value).encode('utf-8'))
+    return '{}:{}'.format(name, hashlib.sha1(b'\0'.join(parts)).hexdigest())
+
+
+def orbit_digest(orb, t=None):
+    """Content digest of the solution of orb over the time grid t."""
+    if t is None:
+        t = orb.t
+    options = sorted((k, repr(v)) for k, v in orb.integrator_options.items())
+    key = repr((FORMAT, [float(x) for x in orb.init], model_identity(orb.model),
+                [float(p) for p in orb.model_pars], np.shape(t), array_digest(t),
+                orb.integrator, options, orb.dense_output,
+                [repr(c) for c in orb.constraints]))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _save_column(path, name, array):
+    tmp = os.path.join(path, name + '.tmp.npy')
+    np.save(tmp, array)
+    os.replace(tmp, os.path.join(path, name + '.npy'))
+
+
+def save(path, orbits):
+    """Write the solutions of the (solved) orbits to the store at path.
+
+    Orbits with dense output store the states at the solver steps only.
+    meta.json is written last, a store without it is incomplete.
+    """
+    unsolved = [orb.label for orb in orbits
+                if not (orb.is_solved and orb._cache_key == orb._solution_key(orb.t))]
+    if unsolved:
+        raise ValueError("orbits not solved with their own settings: {}".format(unsolved))
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    meta_file = os.path.join(path, 'meta.json')
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+    lengths = [len(orb.solution) for orb in orbits]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    Ndim = orbits[0].Ndim
+    _save_column(path, 'inits', np.array([orb.init for orb in orbits], dtype=float))
+    _save_column(path, 't', np.concatenate(
+        [np.asarray(orb.t_solution, dtype=float) for orb in orbits]))
+    _save_column(path, 'solution', np.concatenate(
+        [np.asarray(orb.solution, dtype=float).reshape(-1, Ndim) for orb in orbits]))
+    _save_column(path, 'offsets', offsets)
+    orb = orbits[0]
+    meta = {'format': FORMAT,
+            'names': orb.names,
+            'labels': [o.label for o in orbits],
+            'model': model_identity(orb.model),
+            'model_pars': [[float(p) for p in o.model_pars] for o in orbits],
+            'integrator': [o.integrator for o in orbits],
+            'terminated': [bool(o.terminated) for o in orbits],
+            'digests': [orbit_digest(o) for o in orbits]}
+    tmp = meta_file + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(tmp, meta_file)
+
+
+def load(path, mmap=True):
+    """Open the store at path: (meta, {column: array}), memory-mapped by default."""
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta.get('format') != FORMAT:
+        raise ValueError("{} has store format {}, expected {}".format(
+            path, meta.get('format'), FORMAT))
+    mode = 'r' if mmap else None
+    columns = dict((name, np.load(os.path.join(path, name + '.npy'), mmap_mode=mode))
+                   for name in _COLUMNS)
+    return meta, columns
+
+
+def restore(path, orbits, mmap=True):
+    """Give the orbits their stored solution when their digest matches.
+
+    Returns the number of orbits restored; the others are left untouched.
+    A missing store restores nothing, neither are orbits with dense output
+    (the interpolant is not stored).
+    """
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return 0
+    meta, columns = load(path, mmap=mmap)
+    where = dict((d, i) for i, d in enumerate(meta['digests']))
+    offsets = columns['offsets']
+    n = 0
+    for orb in orbits:
+        i = None if orb.dense_output else where.get(orbit_digest(orb))
+        if i is None:
+            continue
+        rows = slice(int(offsets[i]), int(offsets[i + 1]))
+        orb.solution = columns['solution'][rows]
+        orb.t_solution = columns['t'][rows]
+        orb.dense = None
+        orb._drop_derived()
+        orb.solver_info = {}
+        orb.n_valid = len(orb.solution)
+        orb.terminated = meta['terminated'][i]
+        orb._cache_key = orb._solution_key(orb.t)
+        orb.is_solved = True
+        n += 1
+    return n
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        sweep.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: Parameter sweeps over model_pars. For every point of a
+             parameter grid the same initial conditions are integrated as
+             one ensemble and each orbit is reduced to a few summaries.
+             Points are processed in chunks (in parallel), every chunk is
+             written to its own file as soon as it is done, so an
+             interrupted sweep resumes from the missing chunks.
+"""
+import itertools
+import json
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import ensemble
+import observables
+from orbit import array_digest
+from store import model_identity
+from protocol import batch_model
+
+_MANIFEST = 'sweep.json'
+
+
+def _last_valid(solution):
+    """Index of the last finite row of each orbit of solution (N, T, Ndim)."""
+    ok = np.all(np.isfinite(solution), axis=2)
+    return solution.shape[1] - 1 - np.argmax(ok[:, ::-1], axis=1)
+
+
+class FinalState(object):
+    """Summary: last finite state of each orbit, shape (N, Ndim)."""
+
+    def __call__(self, solution, t, model, model_pars):
+        return solution[np.arange(len(solution)), _last_valid(solution)]
+
+    def __repr__(self):
+        return 'FinalState()'
+
+
+class FixedPointReached(object):
+    """Summary: True where the speed at the final state is below tol."""
+
+    def __init__(self, tol=1e-6):
+        self.tol = tol
+
+    def __repr__(self):
+        return 'FixedPointReached(tol={!r})'.format(self.tol)
+
+    def __call__(self, solution, t, model, model_pars):
+        final = FinalState()(solution, t, model, model_pars)
+        with np.errstate(invalid='ignore'):
+            speed = np.sqrt(np.sum(batch_model(model, model_pars)(final.T)**2.0, axis=0))
+            return speed < self.tol
+
+
+class CrossingCount(object):
+    """Summary: number of crossings of a section.Section along each orbit."""
+
+    def __init__(self, section):
+        self.section = section
+
+    def __repr__(self):
+        s = self.section
+        if s.func is not None:
+            g = 'func={}'.format(model_identity(s.func))
+        else:
+            g = 'normal={!r}, offset={!r}'.format(s.normal.tolist(), s.offset)
+        return 'CrossingCount(section=Section({}, direction={!r}))'.format(g, s.direction)
+
+    def __call__(self, solution, t, model, model_pars):
+        g = self.section(np.moveaxis(solution, 2, 0))      # (N, T)
+        return np.sum(self.section.crossed(g[:, :-1], g[:, 1:]), axis=1)
+
+
+class Observable(object):
+    """Summary: a model observable (see observables.py) of each orbit,
+    reduced over time with 'final', 'min', 'max' or 'mean'.
+
+    Summaries of the same solution share the evaluation of an observable
+    through evaluated, the {name: values} of that solution (see _run_chunk).
+    """
+
+    _reductions = {'min': np.nanmin, 'max': np.nanmax, 'mean': np.nanmean}
+
+    def __init__(self, name, reduce='final'):
+        if reduce != 'final' and reduce not in self._reductions:
+            raise ValueError("reduce must be 'final', 'min', 'max' or 'mean'")
+        self.name = name
+        self.reduce = reduce
+
+    def __repr__(self):
+        return 'Observable({!r}, reduce={!r})'.format(self.name, self.reduce)
+
+    def __call__(self, solution, t, model, model_pars, evaluated=None):
+        if evaluated is None:
+            evaluated = {}
+        values = evaluated.get(self.name)
+        if values is None:
+            values = observables.evaluate(model, self.name, solution, model_pars)
+            evaluated[self.name] = values
+        if self.reduce == 'final':
+            return values[np.arange(len(values)), _last_valid(solution)]
+        with np.errstate(all='ignore'):
+            return self._reductions[self.reduce](values, axis=1)
+
+
+def _summary_identity(summary):
+    """Stable description of a summary for the manifest: the identity of
+    the code of a function, the repr of an object whose class defines one
+    (with its parameters), otherwise the name of its class."""
+    if hasattr(summary, '__code__') or type(summary).__repr__ is object.__repr__:
+        return model_identity(summary)
+    return repr(summary)
+
+
+def _run_chunk(filename, model, points, inits, t, summaries, method, options,
+               constraints):
+    """Worker: integrate every parameter point of a chunk and save summaries."""
+    results = dict((name, []) for name in summaries)
+    for point in points:
+        model_pars = list(point)
+        solution = ensemble.integrate(model, inits, t, model_pars=model_pars,
+                                      method=method, constraints=constraints,
+                                      **options)
+        evaluated = {}      # observables of this solution, for the Observable summaries
+        for name, summary in summaries.items():
+            if isinstance(summary, Observable):
+                value = summary(solution, t, model, model_pars, evaluated=evaluated)
+            else:
+                value = summary(solution, t, model, model_pars)
+            results[name].append(value)
+    tmp = filename + '.tmp.npz'
+    np.savez(tmp, **dict((name, np.array(v)) for name, v in results.items()))
+    os.replace(tmp, filename)   # a chunk file is either complete or absent
+    return filename
+
+
+class Sweep(object):
+    """Integrate inits (N, Ndim) on the time grid t for many model_pars.
+
+    param_grid is either a list of 1D arrays, one per parameter, whose
+    cartesian product is swept, or an array (n_points, n_pars) of explicit
+    points. summaries maps names to picklable callables
+    summary(solution, t, model, model_pars) -> array with one row per orbit,
+    solution having shape (N, len(t), Ndim); FinalState, FixedPointReached
+    and CrossingCount are provided.
+    """
+
+    def __init__(self, model, param_grid, inits, t, summaries=None,
+                 method='rk45', integrator_options=None, constraints=None):
+        self.model = model
+        if isinstance(param_grid, np.ndarray) and param_grid.ndim == 2:
+            self.points = np.array(param_grid, dtype=float)
+        else:
+            self.points = np.array(list(itertools.product(*param_grid)), dtype=float)
+        self.inits = np.array(inits, dtype=float)
+        self.t = np.asarray(t, dtype=float)
+        if summaries is None:
+            summaries = {'final_state': FinalState()}
+        self.summaries = summaries
+        self.method = method
+        if integrator_options is None:
+            integrator_options = dict()
+        self.integrator_options = integrator_options
+        self.constraints = constraints
+
+    def __len__(self):
+        return len(self.points)
+
+    def _manifest(self, chunk_size):
+        options = sorted((k, repr(v)) for k, v in self.integrator_options.items())
+        return {'model': model_identity(self.model),
+                'integrator_options': repr(options),
+                'constraints': [repr(c) for c in self.constraints or []],
+                'points': array_digest(self.points),
+                'inits': array_digest(self.inits),
+                't': array_digest(self.t),
+                'summaries': dict((name, _summary_identity(s))
+                                  for name, s in self.summaries.items()),
+                'method': self.method,
+                'chunk_size': chunk_size,
+                'n_chunks': int(np.ceil(len(self.points) / float(chunk_size)))}
+
+    def _check_manifest(self, path, chunk_size):
+        manifest = self._manifest(chunk_size)
+        filename = os.path.join(path, _MANIFEST)
+        if os.path.exists(filename):
+            with open(filename) as f:
+                old = json.load(f)
+            changed = sorted(k for k in set(old) | set(manifest)
+                             if old.get(k) != manifest.get(k))
+            if changed:
+                raise ValueError("{} holds a different sweep (changed: {})".format(
+                    path, ', '.join(changed)))
+        else:
+            with open(filename, 'w') as f:
+                json.dump(manifest, f, indent=2)
+        return manifest
+
+    def chunk_file(self, path, i):
+        return os.path.join(path, 'chunk_{:06d}.npz'.format(i))
+
+    def run(self, path, chunk_size=100, n_workers=None):
+        """Run the missing chunks of the sweep, writing them under path.
+
+        With n_workers=1 the chunks run in this process. Returns load(path).
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        manifest = self._check_manifest(path, chunk_size)
+        todo = [i for i in range(manifest['n_chunks'])
+                if not os.path.exists(self.chunk_file(path, i))]
+        args = [(self.chunk_file(path, i), self.model,
+                 self.points[i * chunk_size:(i + 1) * chunk_size],
+                 self.inits, self.t, self.summaries, self.method,
+                 self.integrator_options, self.constraints) for i in todo]
+        if n_workers == 1:
+            for a in args:
+                _run_chunk(*a)
+        elif args:
+            with ProcessPoolExecutor(max_workers=n_workers) as pool:
+                for future in [pool.submit(_run_chunk, *a) for a in args]:
+                    future.result()
+        return self.load(path)
+
+    def done(self, path, chunk_size=100):
+        """Fraction of the chunks already on disk."""
+        n = self._manifest(chunk_size)['n_chunks']
+        return sum(os.path.exists(self.chunk_file(path, i)) for i in range(n)) / float(n)
+
+    def load(self, path):
+        """Summaries of the finished sweep, each of shape (n_points, N, ...)."""
+        with open(os.path.join(path, _MANIFEST)) as f:
+            manifest = json.load(f)
+        parts = dict((name, []) for name in manifest['summaries'])
+        for i in range(manifest['n_chunks']):
+            with np.load(self.chunk_file(path, i)) as data:
+                for name in parts:
+                    parts[name].append(data[name])
+        return dict((name, np.concatenate(v)) for name, v in parts.items())
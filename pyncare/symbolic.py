@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        symbolic.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: Models defined by symbolic expressions (needs sympy). The
+             right hand side and its analytic Jacobian are compiled to
+             vectorized NumPy code with common subexpressions evaluated
+             once. The generated source is cached on disk by a hash of
+             the expressions, so sympy only works the first time.
+
+                 x, y, lam = sympy.symbols('x y lambda')
+                 model = SymbolicModel([x, y], [y, -lam * x], [lam])
+                 model([0.1, 0.2], None, [2.0])
+"""
+import hashlib
+import os
+
+_CACHE_VERSION = '2'    # bump when the generated code changes
+
+
+def default_cache_dir():
+    """$PYNCARE_CACHE or ~/.cache/pyncare."""
+    return os.environ.get('PYNCARE_CACHE',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'pyncare'))
+
+
+def _sympy():
+    try:
+        import sympy
+    except ImportError:
+        raise ImportError("symbolic models need sympy: pip install sympy")
+    return sympy
+
+
+def _cse_body(sympy, exprs, indent='    '):
+    """Source lines computing exprs with shared subexpressions, and results."""
+    from sympy.printing.numpy import NumPyPrinter
+    printer = NumPyPrinter({'fully_qualified_modules': True})
+    replacements, reduced = sympy.cse(exprs, symbols=sympy.numbered_symbols('_c'))
+    lines = ['{}{} = {}'.format(indent, s, printer.doprint(e)) for s, e in replacements]
+    return lines, [printer.doprint(e) for e in reduced]
+
+
+def _normalize(sympy, variables, rhs, parameters, time):
+    """Symbols for the names and sympy expressions for strings in rhs."""
+    def symbol(s):
+        return sympy.Symbol(s) if isinstance(s, str) else s
+    variables = [symbol(v) for v in variables]
+    parameters = [symbol(p) for p in parameters]
+    time = None if time is None else symbol(time)
+    names = dict((str(s), s) for s in variables + parameters + [time] if s is not None)
+    rhs = [sympy.sympify(e, locals=names) for e in rhs]
+    return variables, rhs, parameters, time
+
+
+def generate_source(variables, rhs, parameters=(), time=None):
+    """Python source of the functions model() and jacobian() of rhs."""
+    sympy = _sympy()
+    variables, rhs, parameters, time = _normalize(sympy, variables, rhs,
+                                                  parameters, time)
+    # rename to identifiers that can not collide with the generated code
+    subs = dict((v, sympy.Symbol('_v{}'.format(i))) for i, v in enumerate(variables))
+    subs.update((p, sympy.Symbol('_p{}'.format(i))) for i, p in enumerate(parameters))
+    if time is not None:
+        subs[time] = sympy.Symbol('_t')
+    exprs = [e.xreplace(subs) for e in rhs]
+    states = [subs[v] for v in variables]
+    jac = [sympy.diff(e, v) for e in exprs for v in states]
+
+    head = ['    _v{} = init[{}]'.format(i, i) for i in range(len(variables))]
+    head += ['    _p{} = model_pars[{}]'.format(i, i) for i in range(len(parameters))]
+    if time is not None:
+        head += ['    _t = 0.0 if t is None else t']
+    src = ['import functools', 'import numpy', '', '',
+           '# variables: {}'.format(', '.join(str(v) for v in variables)),
+           '# parameters: {}'.format(', '.join(str(p) for p in parameters)),
+           'def model(init, t=None, model_pars=[]):']
+    lines, results = _cse_body(sympy, exprs)
+    src += head + lines + ['    return [{}]'.format(', '.join(results)), '', '']
+    src += ['def jacobian(init, t=None, model_pars=[]):']
+    lines, results = _cse_body(sympy, jac)
+    n = len(variables)
+    rows = ['[{}]'.format(', '.join(results[i * n:(i + 1) * n])) for i in range(n)]
+    src += head + lines + ['    return [{}]'.format(',\n            '.join(rows)), '']
+    return '\n'.join(src)
+
+
+def _digest(variables, rhs, parameters, time):
+    sympy = _sympy()
+    variables, rhs, parameters, time = _normalize(sympy, variables, rhs,
+                                                  parameters, time)
+    key = sympy.srepr((tuple(variables), tuple(rhs), tuple(parameters), time))
+    return hashlib.sha1((_CACHE_VERSION + key).encode('utf-8')).hexdigest()
+
+
+def _cached_source(variables, rhs, parameters, time, cache_dir):
+    """Read the generated source from the cache, generating it if missing."""
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    filename = os.path.join(cache_dir, 'model_{}.py'.format(
+        _digest(variables, rhs, parameters, time)))
+    if os.path.exists(filename):
+        with open(filename) as f:
+            return f.read()
+    source = generate_source(variables, rhs, parameters, time)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(source)
+        os.replace(tmp, filename)
+    except OSError:     # a read-only cache only costs the regeneration
+        pass
+    return source
+
+
+class SymbolicModel(object):
+    """A model compiled from the symbolic rhs of the given variables.
+
+    variables and parameters are sympy symbols (or names); model_pars
+    follow the order of parameters. time is the symbol of t, if rhs
+    depends on it. Instances follow the model convention, carry the
+    analytic `jacobian` and pickle through their generated source; the
+    normalized expressions are kept in `expressions` (None once unpickled).
+    """
+    vectorized = True
+
+    def __init__(self, variables, rhs, parameters=(), time=None, name=None,
+                 cache_dir=None):
+        if len(rhs) != len(variables):
+            raise ValueError("need one expression per variable")
+        self.Ndim = len(variables)
+        self.name = name or 'symbolic_model'
+        self.expressions = _normalize(_sympy(), variables, rhs, parameters, time)
+        self._load(_cached_source(*self.expressions, cache_dir=cache_dir))
+
+    def _load(self, source):
+        namespace = {}
+        exec(compile(source, '<{}>'.format(self.name), 'exec'), namespace)
+        self.source = source
+        self._model = namespace['model']
+        self.jacobian = namespace['jacobian']
+
+    def __call__(self, init, t=None, model_pars=[]):
+        return self._model(init, t, model_pars)
+
+    def __getstate__(self):
+        return {'Ndim': self.Ndim, 'name': self.name, 'source': self.source}
+
+    def __setstate__(self, state):
+        self.Ndim = state['Ndim']
+        self.name = state['name']
+        self.expressions = None
+        self._load(state['source'])
+
+    @property
+    def __name__(self):
+        return self.name
+
+    def __repr__(self):
+        return 'SymbolicModel({})'.format(self.name)
+
+
+
+def _homogenize(sympy, expr, variables, Z):
+    """Split expr(x / Z) as num / (Z**m * den) with num polynomial in Z."""
+    e = sympy.together(expr.xreplace(dict((v, v / Z) for v in variables)), deep=True)
+    num, den = sympy.fraction(sympy.together(sympy.powsimp(sympy.powdenest(e))))
+    m = 0
+    if den.has(Z):
+        if not den.is_polynomial(Z):
+            raise ValueError("{} is not algebraic at infinity".format(expr))
+        m = sympy.Poly(den, Z).degree()
+        den = sympy.cancel(den / Z**m)
+    if den.has(Z) or not num.is_polynomial(Z):
+        raise ValueError("{} is not algebraic at infinity".format(expr))
+    return num, m, den
+
+
+def compactify(model, degree=None, name=None, cache_dir=None):
+    """Poincare compactification of a SymbolicModel by central projection.
+
+    The variables x are mapped to the unit ball X = x / sqrt(1 + |x|**2),
+    Z = sqrt(1 - |X|**2). Writing P(x) = P~(X, Z) / Z**d, the compact
+    field is dX/dtau = P~ - X (X . P~) with the time dtau = dt / Z**(d-1),
+    finite on the equator Z = 0. d is the degree of the model at
+    infinity, found from the expressions unless given. The variables
+    keep their names; time dependent models are not supported.
+    """
+    sympy = _sympy()
+    if getattr(model, 'expressions', None) is None:
+        raise ValueError("compactify needs the expressions of a SymbolicModel")
+    variables, rhs, parameters, time = model.expressions
+    if time is not None and any(e.has(time) for e in rhs):
+        raise ValueError("compactify does not support time dependent models")
+    Z = sympy.Dummy('Z', positive=True)
+    parts = [_homogenize(sympy, e, variables, Z) for e in rhs]
+    if degree is None:
+        degree = max(m for num, m, den in parts)
+    elif degree < max(m for num, m, den in parts):
+        raise ValueError("degree must be at least {}".format(max(m for num, m, den in parts)))
+    P = [num * Z**(degree - m) / den for num, m, den in parts]
+    XP = sum(v * p for v, p in zip(variables, P))
+    # clipped, so the field stays finite for round-off just outside the ball
+    Z_ball = sympy.sqrt(sympy.Max(0, 1 - sum(v**2 for v in variables)))
+    compact = [(p - v * XP).xreplace({Z: Z_ball}) for v, p in zip(variables, P)]
+    return SymbolicModel(variables, compact, parameters,
+                         name=name or 'compact_' + model.name, cache_dir=cache_dir)
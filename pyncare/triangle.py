@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+File:        triangle.py
+Author:      Efrain Torres-Lomas
+Email:       efrain@fisica.ugto.mx
+Github:      https://github.com/elchinot7
+Description: Panels of triangle plots. The orbits are solved once and every
+             panel draws all of them as a single LineCollection built from
+             two columns of the solutions, plus a single quiver for the
+             flow arrows.
+
+             Headless figures can render the panels in a pool of processes:
+             each worker rasterizes one panel at the pixel size of its axes
+             and the figure shows the images (labels and ticks are still
+             drawn by the figure itself).
+"""
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from utils import plot_quiver_2D
+
+
+def layout(vars_to_plot):
+    """(row, col, varx, vary) of the lower triangle panels of an M x M grid."""
+    M = len(vars_to_plot) - 1
+    panels = []
+    for i in range(M):
+        for j in range(M):
+            row, col = M - 1 - i, j
+            if row >= col:
+                panels.append((row, col, vars_to_plot[j], vars_to_plot[M - i]))
+    return panels
+
+
+def stack(solutions):
+    """One (N, N_t, Ndim) array when the solutions have the same length,
+    otherwise the list of solutions."""
+    if len(set(len(s) for s in solutions)) == 1:
+        return np.stack(solutions)
+    return [np.asarray(s) for s in solutions]
+
+
+def segments(data, ix, iy):
+    """Columns ix, iy of the stacked solutions, as LineCollection segments."""
+    if isinstance(data, np.ndarray):
+        return data[:, :, [ix, iy]]
+    return [s[:, [ix, iy]] for s in data]
+
+
+def limits(data, index, margin=0.05):
+    """(min, max) over the columns index of all the solutions, with margin."""
+    if isinstance(data, np.ndarray):
+        values = data[:, :, index]
+    else:
+        values = np.concatenate([s[:, index].ravel() for s in data])
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return (-1.0, 1.0)
+    lo, hi = values.min(), values.max()
+    pad = margin * (hi - lo) if hi > lo else 0.5
+    return (lo - pad, hi + pad)
+
+
+def draw_panel(ax, lines, colors, arrows=None, arrow_kws=None, **kwargs):
+    """Draw the lines (segments) with one LineCollection and the arrows
+    (x, y, u, v, colors) with one quiver. kwargs go to the LineCollection."""
+    from matplotlib.collections import LineCollection
+    collection = LineCollection(lines, colors=colors, **kwargs)
+    ax.add_collection(collection)
+    if arrows is not None and len(arrows[0]):
+        x, y, u, v, arrow_colors = arrows
+        options = dict(arrow_kws or {})
+        options['color'] = arrow_colors
+        plot_quiver_2D(ax=ax, x=x, y=y, u=u, v=v, arrow_kws=options)
+    return collection
+
+
+def _render(task):
+    """Worker: rasterize one panel, returns its RGBA image."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    lines, colors, arrows, arrow_kws, kwargs, xlim, ylim, size, dpi = task
+    fig = Figure(figsize=(size[0] / dpi, size[1] / dpi), dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    fig.patch.set_alpha(0.0)
+    ax = fig.add_axes([0.0, 0.0, 1.0, 1.0])
+    ax.set_axis_off()
+    draw_panel(ax, lines, colors, arrows, arrow_kws, **kwargs)
+    ax.set_xlim(xlim)
+    ax.set_ylim(ylim)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba()).copy()
+
+
+def render_panels(axes, tasks, n_workers=None):
+    """Rasterize the panels in a process pool and show them in axes.
+
+    tasks are (lines, colors, arrows, arrow_kws, kwargs) per axes; the
+    axes limits must be set beforehand, they fix the extent of the images.
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    fig = axes[0].figure
+    dpi = fig.dpi
+    jobs = []
+    for ax, task in zip(axes, tasks):
+        box = ax.get_position()
+        size = (max(1, int(round(box.width * fig.get_figwidth() * dpi))),
+                max(1, int(round(box.height * fig.get_figheight() * dpi))))
+        jobs.append(tuple(task) + (ax.get_xlim(), ax.get_ylim(), size, dpi))
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        images = list(pool.map(_render, jobs))
+    for ax, image, job in zip(axes, images, jobs):
+        xlim, ylim = job[5], job[6]
+        ax.imshow(image, extent=xlim + ylim, aspect='auto', origin='upper',
+                  interpolation='none')
+        ax.set_xlim(xlim)
+        ax.set_ylim(ylim)
@@ -9,7 +9,6 @@
 """
 
 import numpy as np
-import matplotlib.patches as patches
 
 
 def plot_sphere(ax, phi_i=0, phi_f=2.0*np.pi,
@@ -51,6 +50,7 @@ def plot_circle(ax, r=1, theta_i=0, theta_f=2.0*np.pi, res=50, **kwargs):
 
 def plot_quiver_fancy_2D(ax, x, y, u, v, **kwargs):
     """"Generic vector field using FancyArrowPatches."""
+    import matplotlib.patches as patches    # matplotlib loads on first plot
     u = np.array(u)
     v = np.array(v)
 